@@ -1,5 +1,8 @@
+from asgiref.sync import sync_to_async
+
 from django.contrib.auth.signals import user_logged_in
 from django.db import transaction
+from django.db.models import IntegerField, Value
 
 DEVICE_ID_SESSION_KEY = 'otp_device_id'
 
@@ -45,7 +48,9 @@ def verify_token(user, device_id, token):
     :attr:`~django_otp.models.Device.persistent_id`.
 
     This wraps the verification process in a transaction to ensure that things
-    like throttling polices are properly enforced.
+    like throttling polices are properly enforced. Devices that are throttled
+    (or otherwise refuse verification) are rejected by an unlocked check before
+    the transaction begins.
 
     :param user: The user supplying the token.
     :type user: :class:`~django.contrib.auth.models.User`
@@ -60,6 +65,22 @@ def verify_token(user, device_id, token):
     """
     from django_otp.models import Device
 
+    # This may come from OTP_DEVICE_CACHE, which is fine for a check that we
+    # repeat under the lock.
+    device = Device.from_persistent_id(device_id)
+    if (
+        (device is None)
+        or (device.user_id != user.pk)
+        or (not device.verify_is_allowed()[0])
+    ):
+        return None
+
+    return _verify_locked(user, device_id, token)
+
+
+def _verify_locked(user, device_id, token):
+    from django_otp.models import Device
+
     verified = None
     with transaction.atomic():
         device = Device.from_persistent_id(device_id, for_verify=True)
@@ -73,6 +94,43 @@ def verify_token(user, device_id, token):
     return verified
 
 
+async def averify_token(user, device_id, token):
+    """
+    Asynchronous version of :func:`verify_token`.
+
+    Devices that don't need to be locked (see
+    :meth:`~django_otp.models.Device.lock_for_verify`) are verified natively
+    with :meth:`~django_otp.models.Device.averify_token`. Django doesn't
+    support transactions in asynchronous code, so for the rest, the locked
+    load and verification run together as a single unit in a worker thread.
+    This keeps the throttling guarantees of :func:`verify_token` while costing
+    just one thread hop.
+    """
+    from django_otp.models import Device
+
+    device = await Device.afrom_persistent_id(device_id)
+    if (
+        (device is None)
+        or (device.user_id != user.pk)
+        or (not (await device.averify_is_allowed())[0])
+    ):
+        return None
+
+    if device.lock_for_verify():
+        return await sync_to_async(_verify_locked)(user, device_id, token)
+
+    verified = None
+    device = await Device.afrom_persistent_id(device_id, for_verify=True)
+    if (
+        (device is not None)
+        and (device.user_id == user.pk)
+        and await device.averify_token(token)
+    ):
+        verified = device
+
+    return verified
+
+
 def match_token(user, token):
     """
     Attempts to verify a :term:`token` on every device attached to the given
@@ -92,15 +150,88 @@ def match_token(user, token):
 
     :returns: The device that accepted ``token``, if any.
     :rtype: :class:`~django_otp.models.Device` or ``None``
+
+    Devices that can't accept ``token`` (see
+    :meth:`~django_otp.models.Device.token_is_plausible`) or that are
+    throttled are skipped. The rest are locked in a fixed order and then tried
+    most recently used first.
     """
+    from django_otp.models import Device
+
+    candidates = _match_candidates(devices_for_user(user), token)
+
+    verified = None
     with transaction.atomic():
-        for device in devices_for_user(user, for_verify=True):
-            if device.verify_token(token):
+        # Callers are often in a transaction of their own, so locks may be held
+        # until it commits. We always take them in the same order, so that
+        # concurrent calls can't deadlock.
+        locked = {}
+        for candidate in sorted(candidates, key=_lock_order):
+            device = Device.from_persistent_id(candidate.persistent_id, for_verify=True)
+            if device is not None:
+                locked[candidate.persistent_id] = device
+
+        for candidate in candidates:
+            device = locked.get(candidate.persistent_id)
+            if (device is not None) and device.verify_token(token):
+                verified = device
                 break
-        else:
-            device = None
 
-    return device
+    return verified
+
+
+def _match_candidates(devices, token):
+    """
+    Returns the devices that might accept token, most recently used first.
+    """
+    return sorted(
+        (
+            device
+            for device in devices
+            if device.token_is_plausible(token) and device.verify_is_allowed()[0]
+        ),
+        key=_last_used,
+        reverse=True,
+    )
+
+
+def _lock_order(device):
+    return (device._meta.label_lower, device.pk)
+
+
+def _last_used(device):
+    # Devices that have never been used (or don't record it) sort last.
+    last_used_at = getattr(device, 'last_used_at', None)
+
+    return (last_used_at is not None, last_used_at or 0)
+
+
+async def amatch_token(user, token):
+    """
+    Asynchronous version of :func:`match_token`. As with
+    :func:`averify_token`, if all of the candidate devices can be verified
+    without locking them, they're verified natively. Otherwise, the
+    transaction runs in a single worker thread.
+    """
+    from django_otp.models import Device
+
+    candidates = [
+        device
+        async for device in adevices_for_user(user)
+        if device.token_is_plausible(token) and (await device.averify_is_allowed())[0]
+    ]
+    candidates.sort(key=_last_used, reverse=True)
+    if any(device.lock_for_verify() for device in candidates):
+        return await sync_to_async(match_token)(user, token)
+
+    for candidate in candidates:
+        device = await Device.afrom_persistent_id(
+            candidate.persistent_id, for_verify=True
+        )
+        if (device is not None) and await device.averify_token(token):
+            return device
+
+    return None
 
 
 def devices_for_user(user, confirmed=True, for_verify=False):
@@ -121,14 +252,61 @@ def devices_for_user(user, confirmed=True, for_verify=False):
         concurrent verifications from succeeding. In which case, this must be
         called inside a transaction.
 
+    If the user was installed by :class:`~django_otp.middleware.OTPMiddleware`,
+    the devices are only loaded once per request (unless ``for_verify`` is
+    ``True``). Saving or deleting any device discards the remembered results.
+
     :rtype: iterable
     """
     if user.is_anonymous:
         return
 
+    if for_verify:
+        yield from _load_devices(user, confirmed, for_verify=True)
+    else:
+        key = ('devices_for_user', _confirmed_key(confirmed))
+        devices = _memo_get(user, key)
+        if devices is _MISSING:
+            version = _device_version()
+            devices = list(_load_devices(user, confirmed))
+            _memo_set(user, key, version, devices)
+
+        yield from devices
+
+
+async def adevices_for_user(user, confirmed=True):
+    """
+    Asynchronous version of :func:`devices_for_user`. This is an asynchronous
+    iterable and shares the per-request memoization of the synchronous version.
+
+    There is no ``for_verify`` parameter, as devices can only be locked inside
+    a transaction, which asynchronous code can't open. Use
+    :func:`averify_token` to verify tokens safely.
+
+    :rtype: asynchronous iterable
+    """
+    if user.is_anonymous:
+        return
+
+    key = ('devices_for_user', _confirmed_key(confirmed))
+    devices = _memo_get(user, key)
+    if devices is _MISSING:
+        version = _device_version()
+        devices = [
+            device
+            for device_set in _device_sets(user, confirmed)
+            async for device in device_set
+        ]
+        _memo_set(user, key, version, devices)
+
+    for device in devices:
+        yield device
+
+
+def _load_devices(user, confirmed, for_verify=False):
     for model in device_classes():
         device_set = model.objects.devices_for_user(user, confirmed=confirmed)
-        if for_verify:
+        if for_verify and model.lock_for_verify():
             device_set = device_set.select_for_update()
 
         yield from device_set
@@ -138,7 +316,9 @@ def user_has_device(user, confirmed=True):
     """
     Return ``True`` if the user has at least one device.
 
-    Returns ``False`` for anonymous users.
+    Returns ``False`` for anonymous users. This makes a single ``EXISTS``-style
+    query across all device models (one per database, if device models live in
+    different databases) and doesn't load any devices.
 
     :param user: standard or custom user object.
     :type user: :class:`~django.contrib.auth.models.User`
@@ -147,24 +327,199 @@ def user_has_device(user, confirmed=True):
         Otherwise, this can be any true or false value to limit the query
         to confirmed or unconfirmed devices, respectively.
     """
-    try:
-        next(devices_for_user(user, confirmed=confirmed))
-    except StopIteration:
+    if user.is_anonymous:
+        return False
+
+    has_device = _memo_has_device(user, confirmed)
+    if has_device is _MISSING:
+        version = _device_version()
+        has_device = any(
+            device_set.exists()
+            for device_set in _union_by_db(_device_sets(user, confirmed))
+        )
+        _memo_set(
+            user, ('user_has_device', _confirmed_key(confirmed)), version, has_device
+        )
+
+    return has_device
+
+
+async def auser_has_device(user, confirmed=True):
+    """
+    Asynchronous version of :func:`user_has_device`.
+    """
+    if user.is_anonymous:
+        return False
+
+    has_device = _memo_has_device(user, confirmed)
+    if has_device is _MISSING:
+        version = _device_version()
         has_device = False
-    else:
-        has_device = True
+        for device_set in _union_by_db(_device_sets(user, confirmed)):
+            if await device_set.aexists():
+                has_device = True
+                break
+        _memo_set(
+            user, ('user_has_device', _confirmed_key(confirmed)), version, has_device
+        )
 
     return has_device
 
 
+def device_summaries_for_user(user, confirmed=True):
+    """
+    Return lightweight summaries of all devices registered to the given user.
+
+    This is an alternative to :func:`devices_for_user` for when you only need
+    to list a user's devices, as when offering a choice of devices. Rather than
+    one query per device model, it makes a single ``UNION ALL`` query (per
+    database) for just the identifying columns. Full device objects are only
+    loaded if you ask for them.
+
+    Returns an empty list for anonymous users. Memoized per request in the same
+    way as :func:`devices_for_user`. Device models with different kinds of
+    primary key (integers or UUIDs, say) are queried separately.
+
+    :param user: standard or custom user object.
+    :type user: :class:`~django.contrib.auth.models.User`
+
+    :param bool confirmed: If ``None``, all matching devices are returned.
+        Otherwise, this can be any true or false value to limit the query
+        to confirmed or unconfirmed devices, respectively.
+
+    :rtype: list of :class:`~django_otp.models.DeviceSummary`
+    """
+    from django_otp.models import DeviceSummary
+
+    if user.is_anonymous:
+        return []
+
+    key = ('device_summaries_for_user', _confirmed_key(confirmed))
+    summaries = _memo_get(user, key)
+    if summaries is _MISSING:
+        version = _device_version()
+        models = device_classes()
+        device_sets = (
+            device_set.annotate(otp_model_index=Value(index)).values_list(
+                'otp_model_index', 'pk', 'name', 'confirmed'
+            )
+            for index, device_set in enumerate(_device_sets(user, confirmed))
+        )
+        rows = sorted(row for rows in _union_by_db(device_sets) for row in rows)
+        summaries = [
+            DeviceSummary(models[index], pk, name, is_confirmed)
+            for index, pk, name, is_confirmed in rows
+        ]
+        _memo_set(user, key, version, summaries)
+
+    return summaries
+
+
+def _memo_has_device(user, confirmed):
+    for kind in ['devices_for_user', 'device_summaries_for_user']:
+        devices = _memo_get(user, (kind, _confirmed_key(confirmed)))
+        if devices is not _MISSING:
+            return len(devices) > 0
+
+    return _memo_get(user, ('user_has_device', _confirmed_key(confirmed)))
+
+
+def _device_sets(user, confirmed):
+    for model in device_classes():
+        yield model.objects.devices_for_user(user, confirmed=confirmed)
+
+
+def _union_by_db(querysets):
+    """
+    Combines querysets with UNION ALL, returning one queryset per database and
+    kind of primary key. Each queryset's default ordering is dropped, as some
+    databases don't allow ORDER BY in the parts of a compound statement.
+    """
+    groups = {}
+    for queryset in querysets:
+        key = (queryset.db, _pk_kind(queryset.model))
+        groups.setdefault(key, []).append(queryset.order_by())
+
+    return [
+        first.union(*rest, all=True) if rest else first
+        for first, *rest in groups.values()
+    ]
+
+
+def _pk_kind(model):
+    """
+    Identifies the type of a model's primary key. Integer keys of any size can
+    share a UNION; anything else (such as a UUID) has to be queried separately.
+    """
+    pk = model._meta.pk
+    while pk.is_relation:
+        pk = pk.target_field
+
+    return 'integer' if isinstance(pk, IntegerField) else pk.get_internal_type()
+
+
+#
+# Request-scoped memoization. OTPMiddleware installs an empty dictionary on
+# request.user as DEVICE_MEMO_ATTR, which we use to remember query results for
+# the rest of the request. Each entry records the device version it was
+# computed at, so saving or deleting any device invalidates it.
+#
+
+DEVICE_MEMO_ATTR = '_otp_device_memo'
+
+_MISSING = object()
+
+
+def _device_version():
+    from django_otp import models  # isort: skip
+
+    return models._device_version
+
+
+def _confirmed_key(confirmed):
+    return None if (confirmed is None) else bool(confirmed)
+
+
+def _memo_get(user, key):
+    memo = getattr(user, DEVICE_MEMO_ATTR, None)
+    if memo is not None:
+        version, value = memo.get(key, (None, _MISSING))
+        if version == _device_version():
+            return value
+
+    return _MISSING
+
+
+def _memo_set(user, key, version, value):
+    memo = getattr(user, DEVICE_MEMO_ATTR, None)
+    if memo is not None:
+        memo[key] = (version, value)
+
+
+_device_classes = (None, ())
+
+
 def device_classes():
     """
     Returns an iterable of all loaded device models.
+
+    The result is computed once and reused until the app registry's model
+    cache is cleared, as it is whenever the set of installed apps or models
+    changes.
     """
     from django.apps import apps  # isort: skip
     from django_otp.models import Device
 
-    for config in apps.get_app_configs():
-        for model in config.get_models():
-            if issubclass(model, Device) and not model._meta.proxy:
-                yield model
+    global _device_classes
+
+    models, classes = _device_classes
+    current = apps.get_models()
+    if current is not models:
+        classes = tuple(
+            model
+            for model in current
+            if issubclass(model, Device) and not model._meta.proxy
+        )
+        _device_classes = (current, classes)
+
+    return classes
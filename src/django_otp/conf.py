@@ -14,6 +14,13 @@ class Settings:
         return {
             'OTP_LOGIN_URL': django.conf.settings.LOGIN_URL,
             'OTP_ADMIN_HIDE_SENSITIVE_DATA': False,
+            'OTP_DEVICE_CACHE': False,
+            'OTP_DEVICE_CACHE_TIMEOUT': 60,
+            'OTP_DEVICE_SUMMARIES': False,
+            'OTP_MIDDLEWARE_CACHE': False,
+            'OTP_MIDDLEWARE_LAZY_DEVICE': False,
+            'OTP_MIDDLEWARE_CACHE_TIMEOUT': 300,
+            'OTP_THROTTLE_CACHE': False,
         }
 
     def __getattr__(self, name):
@@ -5,7 +5,8 @@ from django.dispatch import Signal
 from django.utils.translation import gettext_lazy as _
 from django.utils.translation import ngettext_lazy
 
-from . import devices_for_user, match_token
+from . import device_summaries_for_user, devices_for_user, match_token
+from .conf import settings
 from .models import Device, VerifyNotAllowed
 
 otp_verification_failed = Signal()
@@ -90,6 +91,22 @@ class OTPAuthenticationFormMixin:
         if user is None:
             return
 
+        if self.cleaned_data.get('otp_challenge'):
+            user.otp_device = None
+            try:
+                self._handle_challenge(user)
+            finally:
+                self._update_form(user)
+
+        if self.cleaned_data.get('otp_token'):
+            # Reject throttled devices before taking any locks.
+            try:
+                self._check_verify_is_allowed(self._chosen_device(user, False))
+            except forms.ValidationError:
+                user.otp_device = None
+                self._update_form(user)
+                raise
+
         validation_error = None
         with transaction.atomic():
             try:
@@ -99,9 +116,7 @@ class OTPAuthenticationFormMixin:
                 user.otp_device = None
 
                 try:
-                    if self.cleaned_data.get('otp_challenge'):
-                        self._handle_challenge(device)
-                    elif token:
+                    if token:
                         user.otp_device = self._verify_token(user, token, device)
                     else:
                         raise forms.ValidationError(
@@ -119,11 +134,11 @@ class OTPAuthenticationFormMixin:
         if validation_error:
             raise validation_error
 
-    def _chosen_device(self, user):
+    def _chosen_device(self, user, for_verify=True):
         device_id = self.cleaned_data.get('otp_device')
 
         if device_id:
-            device = Device.from_persistent_id(device_id, for_verify=True)
+            device = Device.from_persistent_id(device_id, for_verify=for_verify)
         else:
             device = None
 
@@ -136,9 +151,16 @@ class OTPAuthenticationFormMixin:
 
         return device
 
-    def _handle_challenge(self, device):
+    def _handle_challenge(self, user):
+        # The challenge gets its own transaction, so anything that the device
+        # defers with on_commit() (such as sending an email) runs once our
+        # locks are released, and we can still report it if it fails.
         try:
-            challenge = device.generate_challenge() if (device is not None) else None
+            with transaction.atomic():
+                device = self._chosen_device(user)
+                challenge = (
+                    device.generate_challenge() if (device is not None) else None
+                )
         except Exception as e:
             raise forms.ValidationError(
                 self.otp_error_messages['challenge_exception'].format(e),
@@ -155,25 +177,30 @@ class OTPAuthenticationFormMixin:
                     code='challenge_message',
                 )
 
-    def _verify_token(self, user, token, device=None):
-        if device is not None:
-            verify_is_allowed, extra = device.verify_is_allowed()
-            if not verify_is_allowed:
-                # Try to match specific conditions we know about.
-                if (
-                    'reason' in extra
-                    and extra['reason'] == VerifyNotAllowed.N_FAILED_ATTEMPTS
-                ):
-                    raise forms.ValidationError(
-                        self.otp_error_messages['n_failed_attempts'] % extra
-                    )
-                if 'error_message' in extra:
-                    raise forms.ValidationError(extra['error_message'])
-                # Fallback to generic message otherwise.
+    def _check_verify_is_allowed(self, device):
+        if device is None:
+            return
+
+        verify_is_allowed, extra = device.verify_is_allowed()
+        if not verify_is_allowed:
+            # Try to match specific conditions we know about.
+            if (
+                'reason' in extra
+                and extra['reason'] == VerifyNotAllowed.N_FAILED_ATTEMPTS
+            ):
                 raise forms.ValidationError(
-                    self.otp_error_messages['verification_not_allowed']
+                    self.otp_error_messages['n_failed_attempts'] % extra
                 )
+            if 'error_message' in extra:
+                raise forms.ValidationError(extra['error_message'])
+            # Fallback to generic message otherwise.
+            raise forms.ValidationError(
+                self.otp_error_messages['verification_not_allowed']
+            )
 
+    def _verify_token(self, user, token, device=None):
+        if device is not None:
+            self._check_verify_is_allowed(device)
             device = device if device.verify_token(token) else None
         else:
             device = match_token(user, token)
@@ -198,7 +225,12 @@ class OTPAuthenticationFormMixin:
 
     @staticmethod
     def device_choices(user):
-        return list((d.persistent_id, d.name) for d in devices_for_user(user))
+        if settings.OTP_DEVICE_SUMMARIES:
+            devices = device_summaries_for_user(user)
+        else:
+            devices = devices_for_user(user)
+
+        return list((d.persistent_id, d.name) for d in devices)
 
 
 class OTPAuthenticationForm(OTPAuthenticationFormMixin, AuthenticationForm):
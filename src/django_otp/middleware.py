@@ -2,16 +2,50 @@ import functools
 
 from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 
+from django.apps import apps
 from django.utils.functional import SimpleLazyObject
 
-from django_otp import DEVICE_ID_SESSION_KEY
-from django_otp.models import Device
+from django_otp import DEVICE_ID_SESSION_KEY, DEVICE_MEMO_ATTR
+from django_otp.conf import settings
+from django_otp.models import Device, _snapshot_cache, _snapshot_key
 
 
 def is_verified(user):
     return user.otp_device is not None
 
 
+class _LazyDevice(SimpleLazyObject):
+    """
+    Stands in for a device whose owner we already know. The device is only
+    loaded when something other than its persistent_id or owner is needed.
+    """
+
+    def __init__(self, persistent_id, user_id):
+        super().__init__(functools.partial(_load_device, persistent_id))
+        self.__dict__['persistent_id'] = persistent_id
+        self.__dict__['user_id'] = user_id
+
+    @property
+    def __class__(self):
+        # Answering isinstance() checks without loading the device keeps
+        # things like pickling the user cheap (and possible in async code).
+        return apps.get_model(self.persistent_id.rsplit('/', 1)[0])
+
+    def __reduce__(self):
+        return (_LazyDevice, (self.persistent_id, self.user_id))
+
+
+def _load_device(persistent_id):
+    device = Device.from_persistent_id(persistent_id)
+    if device is None:
+        # The device was deleted after we looked up its owner. There's nothing
+        # we can stand in for, so fail as loudly as a query would.
+        model = apps.get_model(persistent_id.rsplit('/', 1)[0])
+        raise model.DoesNotExist('Device {0} no longer exists.'.format(persistent_id))
+
+    return device
+
+
 class OTPMiddleware:
     """
     This must be installed after
@@ -21,10 +55,18 @@ class OTPMiddleware:
     ``request.user.otp_device`` to the :class:`~django_otp.models.Device`
     object that has verified the user, or ``None`` if the user has not been
     verified.  As a convenience, this also installs ``user.is_verified()``,
-    which returns ``True`` if ``user.otp_device`` is not ``None``.
+    which returns ``True`` if ``user.otp_device`` is not ``None``, and
+    arranges for :func:`~django_otp.devices_for_user` and
+    :func:`~django_otp.user_has_device` to remember their results for the
+    rest of the request.
 
     This middleware is async capable. It wraps ``request.auser()`` similarly
     to ``request.user`` as described above.
+
+    If :setting:`OTP_MIDDLEWARE_LAZY_DEVICE` or :setting:`OTP_MIDDLEWARE_CACHE`
+    is set, the middleware only looks up the owner of the session's device and
+    ``request.user.otp_device`` is a lazy proxy that won't load the device
+    until it's used.
     """
 
     sync_capable = True
@@ -64,8 +106,10 @@ class OTPMiddleware:
     def _init_user_fields(user):
         user.otp_device = None
         user.is_verified = functools.partial(is_verified, user)
+        setattr(user, DEVICE_MEMO_ATTR, {})
 
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def _normalize_persistent_id(persistent_id: str) -> str:
         # Convert legacy persistent_id values (these used to be full import
         # paths). This won't work for apps with models in sub-modules, but that
@@ -105,7 +149,19 @@ class OTPMiddleware:
 
     def _device_from_persistent_id(self, persistent_id: str):
         persistent_id = self._normalize_persistent_id(persistent_id)
-        return Device.from_persistent_id(persistent_id)
+
+        cache = _snapshot_cache()
+        if (cache is None) and not settings.OTP_MIDDLEWARE_LAZY_DEVICE:
+            return Device.from_persistent_id(persistent_id)
+
+        key = _snapshot_key(persistent_id)
+        user_id = cache.get(key) if (cache is not None) else None
+        if user_id is None:
+            user_id = Device._owner_from_persistent_id(persistent_id)
+            if (user_id is not None) and (cache is not None):
+                cache.set(key, user_id, settings.OTP_MIDDLEWARE_CACHE_TIMEOUT)
+
+        return _LazyDevice(persistent_id, user_id) if (user_id is not None) else None
 
     async def _verify_user_async_via_auser(self, request, auser):
         user = await auser()
@@ -124,4 +180,16 @@ class OTPMiddleware:
 
     async def _adevice_from_persistent_id(self, persistent_id: str):
         persistent_id = self._normalize_persistent_id(persistent_id)
-        return await Device.afrom_persistent_id(persistent_id)
+
+        cache = _snapshot_cache()
+        if (cache is None) and not settings.OTP_MIDDLEWARE_LAZY_DEVICE:
+            return await Device.afrom_persistent_id(persistent_id)
+
+        key = _snapshot_key(persistent_id)
+        user_id = (await cache.aget(key)) if (cache is not None) else None
+        if user_id is None:
+            user_id = await Device._aowner_from_persistent_id(persistent_id)
+            if (user_id is not None) and (cache is not None):
+                await cache.aset(key, user_id, settings.OTP_MIDDLEWARE_CACHE_TIMEOUT)
+
+        return _LazyDevice(persistent_id, user_id) if (user_id is not None) else None
@@ -1,14 +1,25 @@
+from collections import namedtuple
 from contextlib import suppress
 from datetime import timedelta
 import enum
+from functools import partial
+from itertools import count
+from threading import Lock
+
+from asgiref.sync import sync_to_async
 
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import class_prepared, post_delete, post_save
 from django.utils import timezone
 from django.utils.functional import cached_property
 
+from .conf import settings as otp_settings
 from .util import random_number_token
 
 
@@ -38,6 +49,89 @@ class DeviceManager(models.Manager):
         return devices
 
 
+_device_models = (None, {})
+
+
+def _device_model(model_label):
+    """
+    Resolves the model label of a persistent_id to a device model. Returns
+    ``None`` if the model isn't a device.
+
+    Like :func:`~django_otp.device_classes`, results are reused until the app
+    registry's model cache is cleared.
+    """
+    global _device_models
+
+    models, resolved = _device_models
+    current = apps.get_models()
+    if current is not models:
+        resolved = {}
+        _device_models = (current, resolved)
+
+    try:
+        return resolved[model_label]
+    except KeyError:
+        pass
+
+    app_label, model_name = model_label.split(".")
+
+    device_cls = apps.get_model(app_label, model_name)
+    if not issubclass(device_cls, Device):
+        device_cls = None
+    resolved[model_label] = device_cls
+
+    return device_cls
+
+
+class DeviceSummary:
+    """
+    A lightweight description of a device, as returned by
+    :func:`django_otp.device_summaries_for_user`.
+
+    .. attribute:: model
+
+        The :class:`Device` subclass.
+
+    .. attribute:: id
+
+        The device's primary key.
+
+    .. attribute:: name
+
+        The device's name.
+
+    .. attribute:: confirmed
+
+        Whether the device is confirmed.
+
+    """
+
+    def __init__(self, model, id, name, confirmed):
+        self.model = model
+        self.id = id
+        self.name = name
+        self.confirmed = confirmed
+
+    def __repr__(self):
+        return '<DeviceSummary: {0}>'.format(self.persistent_id)
+
+    @property
+    def persistent_id(self):
+        """
+        The same value as the device's
+        :attr:`~django_otp.models.Device.persistent_id`.
+        """
+        return '{0}/{1}'.format(self.model.model_label(), self.id)
+
+    @cached_property
+    def device(self):
+        """
+        The full device object, loaded on first access. This will be ``None``
+        if the device no longer exists.
+        """
+        return self.model.from_persistent_id(self.persistent_id)
+
+
 class Device(models.Model):
     """
     Abstract base model for a :term:`device` attached to a user. Plugins must
@@ -93,6 +187,9 @@ class Device(models.Model):
 
     objects = DeviceManager()
 
+    # Fields that OTP_DEVICE_CACHE must not store.
+    _secret_fields = []
+
     class Meta:
         abstract = True
 
@@ -133,26 +230,95 @@ class Device(models.Model):
             prevent concurrent verifications from succeeding. In which case,
             this must be called inside a transaction.
 
+        If :setting:`OTP_DEVICE_CACHE` is enabled, devices loaded without
+        ``for_verify`` are read through the cache. Their secret fields aren't
+        cached, so they're loaded from the database if you use them.
+
         """
+        cache = None if for_verify else _device_cache()
+        if cache is not None:
+            key = _device_cache_key(persistent_id)
+            device = _from_cache_state(cache.get(key))
+            _device_cache_stats.record(hit=(device is not None))
+            if device is not None:
+                return device
+
         with suppress(ValueError, LookupError):
-            return cls._filter_persistent_id(persistent_id, for_verify).first()
+            device = cls._filter_persistent_id(persistent_id, for_verify).first()
+            if (device is not None) and (cache is not None):
+                cache.set(
+                    key,
+                    _cache_state(device),
+                    otp_settings.OTP_DEVICE_CACHE_TIMEOUT,
+                )
+            return device
         return None
 
     @classmethod
     async def afrom_persistent_id(cls, persistent_id, for_verify=False):
+        cache = None if for_verify else _device_cache()
+        if cache is not None:
+            key = _device_cache_key(persistent_id)
+            device = _from_cache_state(await cache.aget(key))
+            _device_cache_stats.record(hit=(device is not None))
+            if device is not None:
+                return device
+
         with suppress(ValueError, LookupError):
-            return await cls._filter_persistent_id(persistent_id, for_verify).afirst()
+            device = await cls._filter_persistent_id(persistent_id, for_verify).afirst()
+            if (device is not None) and (cache is not None):
+                await cache.aset(
+                    key,
+                    _cache_state(device),
+                    otp_settings.OTP_DEVICE_CACHE_TIMEOUT,
+                )
+            return device
+        return None
+
+    @classmethod
+    def lock_for_verify(cls):
+        """
+        Returns ``True`` if devices of this class need to be loaded with
+        :meth:`~django.db.models.query.QuerySet.select_for_update` before
+        verifying a token, which is the case for most devices.
+
+        Devices that protect their own state against concurrent verification
+        (for example, with a conditional update) can return ``False``, in
+        which case APIs with a ``for_verify`` parameter won't lock them.
+
+        :rtype: bool
+
+        """
+        return True
+
+    @classmethod
+    def _owner_from_persistent_id(cls, persistent_id):
+        """
+        Returns the user_id of a device without loading it, or ``None`` if
+        there is no such device.
+        """
+        with suppress(ValueError, LookupError):
+            device_set = cls._filter_persistent_id(persistent_id)
+            if device_set is not None:
+                return device_set.values_list('user_id', flat=True).first()
+        return None
+
+    @classmethod
+    async def _aowner_from_persistent_id(cls, persistent_id):
+        with suppress(ValueError, LookupError):
+            device_set = cls._filter_persistent_id(persistent_id)
+            if device_set is not None:
+                return await device_set.values_list('user_id', flat=True).afirst()
         return None
 
     @classmethod
     def _filter_persistent_id(cls, persistent_id, for_verify=False):
         model_label, device_id = persistent_id.rsplit("/", 1)
-        app_label, model_name = model_label.split(".")
 
-        device_cls = apps.get_model(app_label, model_name)
-        if issubclass(device_cls, Device):
+        device_cls = _device_model(model_label)
+        if device_cls is not None:
             device_set = device_cls.objects.filter(id=int(device_id))
-            if for_verify:
+            if for_verify and device_cls.lock_for_verify():
                 device_set = device_set.select_for_update()
             return device_set
         return None
@@ -233,6 +399,18 @@ class Device(models.Model):
         """
         return (True, None)
 
+    async def averify_is_allowed(self):
+        """
+        Asynchronous version of :meth:`verify_is_allowed`.
+
+        The default implementation calls :meth:`verify_is_allowed`, which is
+        fine as long as that doesn't do any I/O. Override both if it does.
+
+        :rtype: (bool, dict or ``None``)
+
+        """
+        return self.verify_is_allowed()
+
     def verify_token(self, token):
         """
         Verifies a token.
@@ -246,6 +424,67 @@ class Device(models.Model):
         """
         return False
 
+    def token_is_plausible(self, token):
+        """
+        Returns ``False`` if this device can't possibly accept ``token``, based
+        on its format and the state of this instance. This must not touch the
+        database.
+
+        :func:`~django_otp.match_token` uses this to avoid locking and
+        verifying devices that would just reject the token. The default
+        implementation returns ``True``.
+
+        :param str token: The OTP token provided by the user.
+        :rtype: bool
+
+        """
+        return True
+
+    def _update_if(self, fields, **conditions):
+        """
+        Saves ``fields`` only if our row still matches ``conditions``, in a
+        single UPDATE. Returns ``True`` if the row was updated.
+
+        This is the basis of optimistic concurrency control for devices that
+        return ``False`` from :meth:`lock_for_verify`.
+        """
+        device_set = type(self)._default_manager.filter(pk=self.pk, **conditions)
+        updated = device_set.update(**{name: getattr(self, name) for name in fields})
+        if updated:
+            _handle_device_update(self)
+
+        return updated > 0
+
+    async def _aupdate_if(self, fields, **conditions):
+        device_set = type(self)._default_manager.filter(pk=self.pk, **conditions)
+        updated = await device_set.aupdate(
+            **{name: getattr(self, name) for name in fields}
+        )
+        if updated:
+            await _ahandle_device_update(self)
+
+        return updated > 0
+
+    async def averify_token(self, token):
+        """
+        Asynchronous version of :meth:`verify_token`.
+
+        The default implementation calls :meth:`verify_token` in a worker
+        thread. Subclasses are encouraged to override this with a native
+        implementation using Django's asynchronous database API.
+
+        :func:`~django_otp.averify_token` and :func:`~django_otp.amatch_token`
+        only call this for devices that don't need to be locked (see
+        :meth:`lock_for_verify`). Devices that do are verified with
+        :meth:`verify_token` under a lock in a worker thread, so for those,
+        this is only used if you call it directly.
+
+        :param str token: The OTP token provided by the user.
+        :rtype: bool
+
+        """
+        return await sync_to_async(self.verify_token)(token)
+
 
 class SideChannelDevice(Device):
     """
@@ -271,6 +510,9 @@ class SideChannelDevice(Device):
         help_text="The timestamp of the moment of expiry of the saved token.",
     )
 
+    _token_fields = ['token', 'valid_until']
+    _secret_fields = ['token']
+
     class Meta:
         abstract = True
 
@@ -288,7 +530,7 @@ class SideChannelDevice(Device):
         self.token = random_number_token(length)
         self.valid_until = timezone.now() + timedelta(seconds=valid_secs)
         if commit:
-            self.save()
+            _save_fields(self, self._token_fields)
 
     def verify_token(self, token):
         """
@@ -299,6 +541,32 @@ class SideChannelDevice(Device):
         :param str token: The OTP token provided by the user.
         :rtype: bool
 
+        """
+        verified = self._consume_token(token)
+        if verified:
+            _save_fields(self, self._token_fields)
+
+        return verified
+
+    async def averify_token(self, token):
+        verified = self._consume_token(token)
+        # Asynchronous code can't hold a row lock, so we only save if no one
+        # else has consumed the token in the meantime.
+        if verified and not await self._aupdate_if(self._token_fields, token=token):
+            verified = False
+            await self.arefresh_from_db()
+
+        return verified
+
+    def token_is_plausible(self, token):
+        """
+        Only a device with an unexpired token can accept one.
+        """
+        return (self.token is not None) and (timezone.now() < self.valid_until)
+
+    def _consume_token(self, token):
+        """
+        Checks the token and clears it if it matches, without saving.
         """
         _now = timezone.now()
 
@@ -309,7 +577,6 @@ class SideChannelDevice(Device):
         ):
             self.token = None
             self.valid_until = _now
-            self.save()
 
             return True
         else:
@@ -356,6 +623,8 @@ class CooldownMixin(models.Model):
         help_text="The last time a token was generated for this device.",
     )
 
+    _cooldown_fields = ['last_generated_timestamp']
+
     class Meta:
         abstract = True
 
@@ -400,7 +669,7 @@ class CooldownMixin(models.Model):
         """
         self.last_generated_timestamp = None
         if commit:
-            self.save()
+            _save_fields(self, self._cooldown_fields)
 
     def cooldown_set(self, commit=True):
         """
@@ -413,7 +682,7 @@ class CooldownMixin(models.Model):
         """
         self.last_generated_timestamp = timezone.now()
         if commit:
-            self.save()
+            _save_fields(self, self._cooldown_fields)
 
     def verify_token(self, token):
         """
@@ -425,6 +694,14 @@ class CooldownMixin(models.Model):
 
         return verified
 
+    async def averify_token(self, token):
+        verified = await super().averify_token(token)
+        if verified:
+            self.cooldown_reset(commit=False)
+            await _asave_fields(self, self._cooldown_fields)
+
+        return verified
+
     @cached_property
     def cooldown_enabled(self):
         return self.get_cooldown_duration() > 0
@@ -495,6 +772,12 @@ class ThrottlingMixin(models.Model):
         default=0, help_text="Number of successive failed attempts."
     )
 
+    _throttle_fields = ['throttling_failure_timestamp', 'throttling_failure_count']
+
+    # Set by throttle_reset() when the cache entries should be removed once
+    # this instance is saved.
+    _throttle_reset_pending = False
+
     class Meta:
         abstract = True
 
@@ -513,6 +796,29 @@ class ThrottlingMixin(models.Model):
         where ``n`` is the number of successive failures. See
         :class:`~django_otp.models.VerifyNotAllowed`.
 
+        With :setting:`OTP_THROTTLE_CACHE`, this first loads the throttling
+        attributes from the cache.
+
+        """
+        if self.throttling_enabled:
+            self._throttle_load()
+
+        return self._throttle_check() or super().verify_is_allowed()
+
+    async def averify_is_allowed(self):
+        """
+        Asynchronous version of :meth:`verify_is_allowed`, which reads
+        :setting:`OTP_THROTTLE_CACHE` asynchronously.
+        """
+        if self.throttling_enabled:
+            await self._athrottle_load()
+
+        return self._throttle_check() or super().verify_is_allowed()
+
+    def _throttle_check(self):
+        """
+        Returns the result of :meth:`verify_is_allowed` if we're throttled,
+        otherwise ``None``.
         """
         if (
             self.throttling_enabled
@@ -536,7 +842,7 @@ class ThrottlingMixin(models.Model):
                     },
                 )
 
-        return super().verify_is_allowed()
+        return None
 
     def throttle_reset(self, commit=True):
         """
@@ -544,27 +850,138 @@ class ThrottlingMixin(models.Model):
         succeeded).
 
         :param bool commit: Pass False if you intend to save the instance
-            yourself.
+            yourself. With :setting:`OTP_THROTTLE_CACHE`, the cache entries are
+            then removed when the instance is saved, rather than immediately.
+            Either way, that waits for the current transaction to commit.
 
         """
         self.throttling_failure_timestamp = None
         self.throttling_failure_count = 0
-        if commit:
-            self.save()
+        if self._throttle_store() is not None:
+            self._throttle_reset_pending = True
+            if commit:
+                self._throttle_flush()
+        elif commit:
+            _save_fields(self, self._throttle_fields)
 
     def throttle_increment(self, commit=True):
         """
         Call this method to increase throttling (normally when a verify attempt
         failed).
 
+        When committing, the failure count is incremented by the database in a
+        single ``UPDATE``, so concurrent failures can't be lost even if the
+        device isn't locked. The instance isn't reloaded, so its own count only
+        reflects concurrent failures once it's refreshed. With
+        :setting:`OTP_THROTTLE_CACHE`, it's incremented by the cache instead
+        and the database isn't touched.
+
         :param bool commit: Pass False if you intend to save the instance
-            yourself.
+            yourself. This has no effect with :setting:`OTP_THROTTLE_CACHE`.
 
         """
         self.throttling_failure_timestamp = timezone.now()
-        self.throttling_failure_count += 1
-        if commit:
-            self.save()
+        self._throttle_reset_pending = False
+        cache = self._throttle_store()
+        if cache is not None:
+            count_key, timestamp_key = _throttle_cache_keys(self)
+            self.throttling_failure_count = _cache_incr(cache, count_key)
+            cache.set(timestamp_key, self.throttling_failure_timestamp, None)
+        elif commit and not self._state.adding:
+            self._throttle_increment_set().update(**self._throttle_increment_values())
+            _handle_device_update(self)
+            self.throttling_failure_count += 1
+        else:
+            self.throttling_failure_count += 1
+            if commit:
+                self.save()
+
+    async def athrottle_increment(self):
+        """
+        Asynchronous version of :meth:`throttle_increment`, which always
+        commits.
+        """
+        self.throttling_failure_timestamp = timezone.now()
+        self._throttle_reset_pending = False
+        cache = self._throttle_store()
+        if cache is not None:
+            count_key, timestamp_key = _throttle_cache_keys(self)
+            self.throttling_failure_count = await _acache_incr(cache, count_key)
+            await cache.aset(timestamp_key, self.throttling_failure_timestamp, None)
+        elif not self._state.adding:
+            await self._throttle_increment_set().aupdate(
+                **self._throttle_increment_values()
+            )
+            await _ahandle_device_update(self)
+            self.throttling_failure_count += 1
+        else:
+            self.throttling_failure_count += 1
+            await self.asave()
+
+    def _throttle_store(self):
+        return None if self._state.adding else _throttle_cache()
+
+    def _throttle_flush(self):
+        """
+        Carries out a pending :meth:`throttle_reset` once the current
+        transaction commits.
+        """
+        cache = self._throttle_store() if self._throttle_reset_pending else None
+        self._throttle_reset_pending = False
+        if cache is not None:
+            transaction.on_commit(
+                partial(cache.delete_many, _throttle_cache_keys(self)),
+                using=self._state.db,
+            )
+
+    async def _athrottle_flush(self):
+        # Asynchronous code can't be in a transaction, so there's no need to
+        # wait.
+        cache = self._throttle_store() if self._throttle_reset_pending else None
+        self._throttle_reset_pending = False
+        if cache is not None:
+            await cache.adelete_many(_throttle_cache_keys(self))
+
+    def _update_if(self, fields, **conditions):
+        updated = super()._update_if(fields, **conditions)
+        if not updated:
+            # We lost to a concurrent change, so our reset doesn't apply.
+            self._throttle_reset_pending = False
+
+        return updated
+
+    async def _aupdate_if(self, fields, **conditions):
+        updated = await super()._aupdate_if(fields, **conditions)
+        if not updated:
+            self._throttle_reset_pending = False
+
+        return updated
+
+    def _throttle_load(self):
+        cache = self._throttle_store()
+        if cache is not None:
+            keys = _throttle_cache_keys(self)
+            self._throttle_loaded(keys, cache.get_many(keys))
+
+    async def _athrottle_load(self):
+        cache = self._throttle_store()
+        if cache is not None:
+            keys = _throttle_cache_keys(self)
+            self._throttle_loaded(keys, await cache.aget_many(keys))
+
+    def _throttle_loaded(self, keys, values):
+        count_key, timestamp_key = keys
+        self.throttling_failure_count = values.get(count_key, 0)
+        self.throttling_failure_timestamp = values.get(timestamp_key)
+
+    def _throttle_increment_set(self):
+        return type(self)._default_manager.filter(pk=self.pk)
+
+    def _throttle_increment_values(self):
+        return {
+            'throttling_failure_count': F('throttling_failure_count') + 1,
+            'throttling_failure_timestamp': self.throttling_failure_timestamp,
+        }
 
     @cached_property
     def throttling_enabled(self):
@@ -621,6 +1038,8 @@ class TimestampMixin(models.Model):
         help_text="The most recent date and time this device was used.",
     )
 
+    _timestamp_fields = ['last_used_at']
+
     class Meta:
         abstract = True
 
@@ -635,4 +1054,342 @@ class TimestampMixin(models.Model):
         """
         self.last_used_at = timezone.now()
         if commit:
-            self.save()
+            _save_fields(self, self._timestamp_fields)
+
+
+class OptimisticLockingMixin(models.Model):
+    """
+    Mixin class for devices that can be verified without a row lock.
+
+    If the setting named by :attr:`optimistic_locking_setting` is enabled,
+    :meth:`lock_for_verify` returns ``False`` and a successful verification
+    is saved with a conditional update, which fails if a concurrent
+    verification has already saved. Otherwise, the device is saved normally,
+    under the lock taken by the caller.
+
+    Subclasses implement ``_verify_token(token)``, which checks the token and
+    updates the instance without saving, and :meth:`get_verify_conditions`.
+    They must also list the fields that a verification changes in
+    ``_verified_fields``. This mixin relies on
+    :class:`~django_otp.models.ThrottlingMixin`. Devices that verify tokens
+    some other way can override :meth:`verify_token` and :meth:`averify_token`
+    and just use :meth:`lock_for_verify`.
+
+    .. attribute:: optimistic_locking_setting
+
+        The name of the setting that enables optimistic locking, such as
+        ``'OTP_HOTP_OPTIMISTIC_LOCKING'``.
+
+    """
+
+    optimistic_locking_setting = None
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def lock_for_verify(cls):
+        """
+        Returns ``False`` if the setting named by
+        :attr:`optimistic_locking_setting` is enabled.
+        """
+        return not getattr(settings, cls.optimistic_locking_setting, False)
+
+    def get_verify_conditions(self):
+        """
+        Returns the lookups that our row must still match for a successful
+        verification to be saved. These are evaluated after
+        ``_verify_token()`` has updated the instance.
+
+        For example, a counter-based device might return
+        ``{'counter__lt': self.counter}``.
+
+        :rtype: dict
+
+        """
+        raise NotImplementedError()
+
+    def verify_token(self, token):
+        verify_allowed, _ = self.verify_is_allowed()
+        if not verify_allowed:
+            return False
+
+        verified = self._verify_token(token)
+        if not verified:
+            self.throttle_increment()
+        elif self.lock_for_verify():
+            _save_fields(self, self._verified_fields)
+        elif not self._update_if(self._verified_fields, **self.get_verify_conditions()):
+            # A concurrent verification got there first.
+            verified = False
+            self.refresh_from_db()
+
+        return verified
+
+    async def averify_token(self, token):
+        verify_allowed, _ = await self.averify_is_allowed()
+        if not verify_allowed:
+            return False
+
+        verified = self._verify_token(token)
+        if not verified:
+            await self.athrottle_increment()
+        # Asynchronous code can't hold a row lock, so this is always saved
+        # conditionally, whatever lock_for_verify() says.
+        elif not await self._aupdate_if(
+            self._verified_fields, **self.get_verify_conditions()
+        ):
+            verified = False
+            await self.arefresh_from_db()
+
+        return verified
+
+
+def _decimal_token_is_plausible(token, digits):
+    """
+    Returns True if token is a non-negative integer of at most digits digits.
+    """
+    try:
+        token = int(token)
+    except Exception:
+        return False
+
+    return 0 <= token < 10**digits
+
+
+def _save_fields(instance, fields):
+    """
+    Saves just the given fields, unless the instance has never been saved.
+    """
+    instance.save(update_fields=None if instance._state.adding else fields)
+
+
+async def _asave_fields(instance, fields):
+    await instance.asave(update_fields=None if instance._state.adding else fields)
+
+
+def _handle_device_update(instance):
+    """
+    QuerySet.update() doesn't send post_save, so call this after using it to
+    change a device.
+    """
+    if isinstance(instance, Device):
+        _handle_device_change(type(instance), instance)
+
+
+# Every time a device is saved or deleted, _device_version is replaced with a
+# new value. Anything that caches device state can record the version it was
+# computed at and discard it when the version changes.
+_device_changes = count()
+_device_version = next(_device_changes)
+
+
+def _handle_device_change(sender, instance, **kwargs):
+    _next_device_version()
+
+    for cache, key in _device_cache_entries(instance):
+        cache.delete(key)
+
+    if isinstance(instance, ThrottlingMixin):
+        instance._throttle_flush()
+
+
+async def _ahandle_device_update(instance):
+    """
+    Asynchronous version of _handle_device_update().
+    """
+    if isinstance(instance, Device):
+        _next_device_version()
+
+        for cache, key in _device_cache_entries(instance):
+            await cache.adelete(key)
+
+        if isinstance(instance, ThrottlingMixin):
+            await instance._athrottle_flush()
+
+
+def _next_device_version():
+    global _device_version
+
+    _device_version = next(_device_changes)
+
+
+def _device_cache_entries(instance):
+    """
+    Yields the (cache, key) pairs that have to be deleted when a device
+    changes.
+    """
+    if instance.pk is not None:
+        cache = _snapshot_cache()
+        if cache is not None:
+            yield cache, _snapshot_key(instance.persistent_id)
+
+        cache = _device_cache()
+        if cache is not None:
+            yield cache, _device_cache_key(instance.persistent_id)
+
+
+# When OTP_MIDDLEWARE_CACHE is enabled, OTPMiddleware caches the owner of each
+# device it loads from a session, keyed by the device's persistent_id. As long
+# as the snapshot is present, the middleware can trust the session without
+# loading the device. Snapshots are deleted whenever the device changes.
+
+
+def _snapshot_cache():
+    return _configured_cache(otp_settings.OTP_MIDDLEWARE_CACHE, 'django_otp.snapshots')
+
+
+def _snapshot_key(persistent_id):
+    return 'django_otp.snapshot.{0}'.format(persistent_id)
+
+
+# When OTP_DEVICE_CACHE is enabled, from_persistent_id() caches the devices it
+# loads (except for verification), keyed by persistent_id. Cached devices are
+# deleted whenever the device changes.
+
+
+DeviceCacheInfo = namedtuple('DeviceCacheInfo', ['hits', 'misses'])
+
+
+class _DeviceCacheStats:
+    def __init__(self):
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def info(self, reset=False):
+        with self.lock:
+            info = DeviceCacheInfo(self.hits, self.misses)
+            if reset:
+                self.hits = self.misses = 0
+
+        return info
+
+
+_device_cache_stats = _DeviceCacheStats()
+
+
+def device_cache_info(reset=False):
+    """
+    Returns the number of :setting:`OTP_DEVICE_CACHE` hits and misses in this
+    process.
+
+    :param bool reset: If ``True``, the counters are reset to zero after
+        reading them.
+
+    :returns: A named tuple with ``hits`` and ``misses``.
+    """
+    return _device_cache_stats.info(reset)
+
+
+def _device_cache():
+    return _configured_cache(otp_settings.OTP_DEVICE_CACHE, 'django_otp.devices')
+
+
+def _device_cache_key(persistent_id):
+    return 'django_otp.device.{0}'.format(persistent_id)
+
+
+def _cache_state(device):
+    """
+    Returns what we cache for a device: everything but its secret fields,
+    which are left to be loaded on demand.
+    """
+    names = [
+        field.attname
+        for field in device._meta.concrete_fields
+        if field.attname not in device._secret_fields
+    ]
+
+    return (
+        device._meta.label_lower,
+        device._state.db,
+        names,
+        [getattr(device, name) for name in names],
+    )
+
+
+def _from_cache_state(state):
+    if state is None:
+        return None
+
+    model_label, db, names, values = state
+    device_cls = _device_model(model_label)
+
+    return device_cls.from_db(db, names, values) if device_cls is not None else None
+
+
+# When OTP_THROTTLE_CACHE is enabled, ThrottlingMixin keeps the failure count
+# and timestamp in a cache instead of the database columns, keyed by the
+# device's model and primary key. The columns are left alone.
+
+
+def _throttle_cache():
+    return _configured_cache(otp_settings.OTP_THROTTLE_CACHE, 'django_otp.throttle')
+
+
+def _throttle_cache_keys(instance):
+    suffix = '{0}/{1}'.format(instance._meta.label_lower, instance.pk)
+
+    return (
+        'django_otp.throttle.count.{0}'.format(suffix),
+        'django_otp.throttle.timestamp.{0}'.format(suffix),
+    )
+
+
+def _cache_incr(cache, key):
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # If add() fails, another process created the key first.
+        count = 1 if cache.add(key, 1, None) else cache.incr(key)
+
+    return count
+
+
+async def _acache_incr(cache, key):
+    try:
+        count = await cache.aincr(key)
+    except ValueError:
+        count = 1 if (await cache.aadd(key, 1, None)) else (await cache.aincr(key))
+
+    return count
+
+
+_local_caches = {}
+
+
+def _configured_cache(alias, name):
+    """
+    Resolves one of our cache settings: ``True`` for a private
+    ``LocMemCache``, a string for an alias in ``CACHES`` or a false value for
+    none.
+    """
+    if alias is True:
+        cache = _local_caches.get(name)
+        if cache is None:
+            cache = _local_caches.setdefault(name, LocMemCache(name, {}))
+    elif alias:
+        cache = caches[alias]
+    else:
+        cache = None
+
+    return cache
+
+
+def _handle_class_prepared(sender, **kwargs):
+    # Connecting to each device model individually (rather than to all
+    # senders) leaves Django's fast-delete path intact for other models.
+    if issubclass(sender, Device):
+        post_save.connect(_handle_device_change, sender=sender)
+        post_delete.connect(_handle_device_change, sender=sender)
+
+
+class_prepared.connect(_handle_class_prepared)
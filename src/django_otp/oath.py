@@ -1,10 +1,11 @@
-from hashlib import sha1
+from functools import lru_cache
 import hmac
-from struct import pack
+from itertools import repeat
+from struct import Struct
 from time import time
 
 
-def hotp(key, counter, digits=6):
+def hotp(key, counter, digits=6, algorithm='sha1'):
     """
     Implementation of the HOTP algorithm from `RFC 4226
     <http://tools.ietf.org/html/rfc4226#section-5>`_.
@@ -12,6 +13,8 @@ def hotp(key, counter, digits=6):
     :param bytes key: The shared secret. A 20-byte string is recommended.
     :param int counter: The password counter.
     :param int digits: The number of decimal digits to generate.
+    :param str algorithm: The HMAC digest: ``'sha1'``, ``'sha256'`` or
+        ``'sha512'``.
 
     :returns: The HOTP token.
     :rtype: int
@@ -29,24 +32,180 @@ def hotp(key, counter, digits=6):
     162583
     399871
     520489
+    >>> hotp(b'12345678901234567890123456789012', 1, 8, 'sha256')
+    46119246
     """
-    msg = pack(b'>Q', counter)
-    hs = hmac.new(key, msg, sha1).digest()
-    hs = list(iter(hs))
+    return HOTP(key, algorithm).token(counter, digits)
 
-    offset = hs[19] & 0x0F
-    bin_code = (
-        (hs[offset] & 0x7F) << 24
-        | hs[offset + 1] << 16
-        | hs[offset + 2] << 8
-        | hs[offset + 3]
-    )
-    hotp = bin_code % pow(10, digits)
 
-    return hotp
+class HOTP:
+    """
+    A reusable HOTP engine bound to a single key.
+
+    The keyed HMAC state is computed once, when the engine is created, and
+    cloned for each counter value. This saves repeating the key setup when
+    several counters are computed with the same key, as when we search a
+    window of counters for a matching token.
+
+    :param bytes key: The shared secret. A 20-byte string is recommended.
+    :param str algorithm: The HMAC digest: ``'sha1'``, ``'sha256'`` or
+        ``'sha512'``.
+
+    >>> engine = HOTP(b'12345678901234567890')
+    >>> engine.token(0)
+    755224
+    >>> engine.token(9)
+    520489
+    >>> engine.token(1, digits=8)
+    94287082
+    """
+
+    def __init__(self, key, algorithm='sha1'):
+        self._key = key
+        self._algorithm = algorithm
+        self._hmac = hmac.new(key, digestmod=algorithm)
+
+    @property
+    def key(self):
+        """The shared secret."""
+        return self._key
+
+    @property
+    def algorithm(self):
+        """The name of the HMAC digest."""
+        return self._algorithm
+
+    def token(self, counter, digits=6):
+        """
+        Computes the HOTP token for a counter value.
+
+        :param int counter: The password counter.
+        :param int digits: The number of decimal digits to generate.
+
+        :returns: The HOTP token.
+        :rtype: int
+
+        """
+        mac = self._hmac.copy()
+        mac.update(_pack_counter(counter))
+
+        return _truncate(mac.digest(), 10**digits)
+
+    def tokens(self, start, count, digits=6):
+        """
+        Computes the HOTP tokens for a range of counter values.
+
+        :param int start: The first password counter.
+        :param int count: The number of consecutive counters.
+        :param int digits: The number of decimal digits to generate.
+
+        :returns: The HOTP tokens for counters ``start`` through ``start +
+            count - 1``, in order.
+        :rtype: list
+
+        """
+        copy = self._hmac.copy
+        modulus = 10**digits
+        tokens = []
+
+        for counter in range(start, start + count):
+            mac = copy()
+            mac.update(_pack_counter(counter))
+            tokens.append(_truncate(mac.digest(), modulus))
+
+        return tokens
+
+
+def hotp_range(key, start, count, digits=6, algorithm='sha1'):
+    """
+    Computes the HOTP tokens for a window of counter values in one call.
+
+    This is equivalent to calling :func:`hotp` for each counter, but the key
+    setup is done only once for the whole window.
+
+    :param bytes key: The shared secret. A 20-byte string is recommended.
+    :param int start: The first password counter.
+    :param int count: The number of consecutive counters.
+    :param int digits: The number of decimal digits to generate.
+    :param str algorithm: The HMAC digest: ``'sha1'``, ``'sha256'`` or
+        ``'sha512'``.
+
+    :returns: The HOTP tokens for counters ``start`` through ``start + count -
+        1``, in order.
+    :rtype: list
+
+    >>> hotp_range(b'12345678901234567890', 3, 4)
+    [969429, 338314, 254676, 287922]
+    """
+    return HOTP(key, algorithm).tokens(start, count, digits)
+
+
+def bulk_hotp(keys, counters, digits=6, algorithm='sha1'):
+    """
+    Computes HOTP tokens for many key/counter pairs.
+
+    This is intended for generating large numbers of expected tokens, such as
+    for load tests or audits. The keyed HMAC state is reused for the most
+    recently seen keys, so runs of counters with the same key are cheap and
+    memory use doesn't grow with the number of distinct keys.
+
+    NumPy is not required. If ``counters`` is a NumPy array, the result will
+    be a NumPy array of 64-bit integers; otherwise it will be a list.
+
+    :param keys: The shared secrets, one for each counter. This may also be a
+        single :class:`bytes` key to use with every counter.
+    :param counters: The password counters.
+    :param int digits: The number of decimal digits to generate.
+    :param str algorithm: The HMAC digest: ``'sha1'``, ``'sha256'`` or
+        ``'sha512'``.
 
+    :returns: The HOTP token for each key/counter pair, in order.
 
-def totp(key, step=30, t0=0, digits=6, drift=0):
+    >>> bulk_hotp([b'12345678901234567890'] * 2 + [b'abcdefghij'], [0, 1, 0])
+    [755224, 287082, 462371]
+    >>> bulk_hotp(b'12345678901234567890', range(3, 6))
+    [969429, 338314, 254676]
+    """
+    if isinstance(keys, bytes):
+        keys = repeat(keys)
+    elif hasattr(keys, '__len__') and hasattr(counters, '__len__'):
+        if len(keys) != len(counters):
+            raise ValueError("keys and counters must have the same length.")
+
+    engine = lru_cache(maxsize=_BULK_HOTP_ENGINES)(HOTP)
+
+    def tokens():
+        for key, counter in zip(keys, counters):
+            yield engine(key, algorithm).token(counter, digits)
+
+    if hasattr(counters, '__array__'):
+        import numpy
+
+        result = numpy.fromiter(tokens(), dtype=numpy.int64, count=len(counters))
+    else:
+        result = list(tokens())
+
+    return result
+
+
+# The number of keyed HMAC states that bulk_hotp() keeps at once.
+_BULK_HOTP_ENGINES = 32
+
+_pack_counter = Struct(b'>Q').pack
+
+
+def _truncate(hs, modulus):
+    """
+    Dynamic truncation of an HMAC digest (RFC 4226, section 5.3).
+    """
+    offset = hs[-1] & 0x0F
+    end = offset + 4
+    bin_code = int.from_bytes(hs[offset:end], 'big') & 0x7FFFFFFF
+
+    return bin_code % modulus
+
+
+def totp(key, step=30, t0=0, digits=6, drift=0, algorithm='sha1'):
     """
     Implementation of the TOTP algorithm from `RFC 6238
     <http://tools.ietf.org/html/rfc6238#section-4>`_.
@@ -59,6 +218,8 @@ def totp(key, step=30, t0=0, digits=6, drift=0):
     :param int drift: The number of time steps to add or remove. Delays and
         clock differences might mean that you have to look back or forward a
         step or two in order to match a token.
+    :param str algorithm: The HMAC digest: ``'sha1'``, ``'sha256'`` or
+        ``'sha512'``.
 
     :returns: The TOTP token.
     :rtype: int
@@ -77,8 +238,11 @@ def totp(key, step=30, t0=0, digits=6, drift=0):
     338314
     254676
     287922
+    >>> seed = b'1234567890' * 6 + b'1234'
+    >>> totp(seed, t0=(now-59), digits=8, algorithm='sha512')
+    90693936
     """
-    return TOTP(key, step, t0, digits, drift).token()
+    return TOTP(key, step, t0, digits, drift, algorithm).token()
 
 
 class TOTP:
@@ -97,6 +261,8 @@ class TOTP:
     :param int drift: The number of time steps to add or remove. Delays and
         clock differences might mean that you have to look back or forward a
         step or two in order to match a token.
+    :param str algorithm: The HMAC digest: ``'sha1'``, ``'sha256'`` or
+        ``'sha512'``.
 
     >>> key = b'12345678901234567890'
     >>> totp = TOTP(key)
@@ -131,21 +297,103 @@ class TOTP:
     359152
     """
 
-    def __init__(self, key, step=30, t0=0, digits=6, drift=0):
-        self.key = key
+    def __init__(self, key, step=30, t0=0, digits=6, drift=0, algorithm='sha1'):
+        self._hotp = HOTP(key, algorithm)
         self.step = step
         self.t0 = t0
         self.digits = digits
         self.drift = drift
         self._time = None
 
+    @property
+    def key(self):
+        """
+        The shared secret.
+
+        The keyed HMAC state is prepared whenever this or :attr:`algorithm`
+        is assigned, so it's shared by every token we compute until one of
+        them changes.
+
+        """
+        return self._hotp.key
+
+    @key.setter
+    def key(self, value):
+        self._hotp = HOTP(value, self.algorithm)
+
+    @property
+    def algorithm(self):
+        """The name of the HMAC digest."""
+        return self._hotp.algorithm
+
+    @algorithm.setter
+    def algorithm(self, value):
+        self._hotp = HOTP(self.key, value)
+
     def token(self):
         """The computed TOTP token."""
-        return hotp(self.key, self.t(), digits=self.digits)
+        return self._hotp.token(self.t(), digits=self.digits)
+
+    def tokens_in_window(self, tolerance=0):
+        """
+        The computed TOTP tokens for a window of time steps.
+
+        :param int tolerance: The number of steps on either side of the
+            current one to include.
+
+        :returns: The tokens at t values in [t - tolerance, t + tolerance], in
+            order.
+        :rtype: list
+
+        >>> totp = TOTP(b'12345678901234567890')
+        >>> totp.time = 60
+        >>> totp.tokens_in_window(1)
+        [287082, 359152, 969429]
+        """
+        return self._hotp.tokens(
+            self.t() - tolerance, 2 * tolerance + 1, digits=self.digits
+        )
+
+    def token_offsets(self, tolerance=0, min_t=None):
+        """
+        Maps the TOTP tokens in a window of time steps to their offsets.
+
+        The current time is read once, so every token in the window is
+        computed for the same moment. If a token appears more than once in the
+        window, it maps to the lowest offset.
+
+        :param int tolerance: The number of steps on either side of the
+            current one to include.
+        :param int min_t: The minimum t value to include.
+
+        :returns: A dictionary mapping each token at t values in [t -
+            tolerance, t + tolerance] (and not less than ``min_t``) to the
+            offset from t at which it was found.
+        :rtype: dict
+
+        >>> totp = TOTP(b'12345678901234567890')
+        >>> totp.time = 60
+        >>> totp.token_offsets(1) == {287082: -1, 359152: 0, 969429: 1}
+        True
+        >>> totp.token_offsets(1, min_t=2) == {359152: 0, 969429: 1}
+        True
+        """
+        t = self._t_at(self.time)
+        start = t - tolerance
+        if (min_t is not None) and (start < min_t):
+            start = min_t
+
+        tokens = self._hotp.tokens(start, t + tolerance + 1 - start, self.digits)
+        offsets = range(start - t, start - t + len(tokens))
+
+        return dict(reversed(list(zip(tokens, offsets))))
 
     def t(self):
         """The computed time step."""
-        return ((int(self.time) - self.t0) // self.step) + self.drift
+        return self._t_at(self.time)
+
+    def _t_at(self, time):
+        return ((int(time) - self.t0) // self.step) + self.drift
 
     @property
     def time(self):
@@ -184,18 +432,13 @@ class TOTP:
         Iff this returns True, `self.drift` will be updated to reflect the
         drift value that was necessary to match the token.
 
+        The current time is read once and all of the tokens in the window are
+        computed up front (see :meth:`token_offsets`), so the cost doesn't
+        depend on where in the window the token is found.
+
         """
-        drift_orig = self.drift
-        verified = False
-
-        for offset in range(-tolerance, tolerance + 1):
-            self.drift = drift_orig + offset
-            if (min_t is not None) and (self.t() < min_t):
-                continue
-            elif self.token() == token:
-                verified = True
-                break
-        else:
-            self.drift = drift_orig
-
-        return verified
+        offset = self.token_offsets(tolerance, min_t).get(token)
+        if offset is not None:
+            self.drift += offset
+
+        return offset is not None
@@ -1,6 +1,8 @@
+from functools import partial
+
 from django.contrib.humanize.templatetags.humanize import naturaltime
 from django.core.mail import send_mail
-from django.db import models
+from django.db import models, transaction
 from django.template import Context, Template
 from django.template.loader import get_template
 from django.utils.translation import gettext
@@ -11,6 +13,7 @@ from django_otp.models import (
     SideChannelDevice,
     ThrottlingMixin,
     TimestampMixin,
+    _save_fields,
 )
 from django_otp.util import hex_validator, random_hex
 
@@ -53,10 +56,23 @@ class EmailDevice(TimestampMixin, CooldownMixin, ThrottlingMixin, SideChannelDev
         help_text='Optional alternative email address to send tokens to',
     )
 
+    # The fields that a successful verification changes, beyond those saved by
+    # SideChannelDevice and CooldownMixin.
+    _verified_fields = [
+        'throttling_failure_count',
+        'throttling_failure_timestamp',
+        'last_used_at',
+    ]
+
     def generate_challenge(self, extra_context=None):
         """
         Generates a random token and emails it to the user.
 
+        The token is saved right away, but the email is only sent once the
+        current transaction commits (immediately, if there isn't one). With
+        :setting:`ATOMIC_REQUESTS`, that's the end of the request, so the
+        forms can't report delivery errors to the user.
+
         :param extra_context: Additional context variables for rendering the
             email template.
         :type extra_context: dict
@@ -84,7 +100,8 @@ class EmailDevice(TimestampMixin, CooldownMixin, ThrottlingMixin, SideChannelDev
 
     def _deliver_token(self, extra_context):
         self.cooldown_set(commit=False)
-        self.generate_token(valid_secs=settings.OTP_EMAIL_TOKEN_VALIDITY, commit=True)
+        self.generate_token(valid_secs=settings.OTP_EMAIL_TOKEN_VALIDITY, commit=False)
+        _save_fields(self, self._cooldown_fields + self._token_fields)
 
         context = {'token': self.token, **(extra_context or {})}
         if settings.OTP_EMAIL_BODY_TEMPLATE:
@@ -103,7 +120,12 @@ class EmailDevice(TimestampMixin, CooldownMixin, ThrottlingMixin, SideChannelDev
         else:
             body_html = None
 
-        self.send_mail(body, html_message=body_html)
+        # Don't hold the transaction (and any locks) open while we talk to the
+        # mail server. Outside of a transaction, this sends immediately.
+        transaction.on_commit(
+            partial(self.send_mail, body, html_message=body_html),
+            using=self._state.db,
+        )
 
         message = gettext("sent by email")
 
@@ -138,12 +160,16 @@ class EmailDevice(TimestampMixin, CooldownMixin, ThrottlingMixin, SideChannelDev
         """"""
         verify_allowed, _ = self.verify_is_allowed()
         if verify_allowed:
-            verified = super().verify_token(token)
+            verified = self._consume_token(token)
 
             if verified:
+                self.cooldown_reset(commit=False)
                 self.throttle_reset(commit=False)
                 self.set_last_used_timestamp(commit=False)
-                self.save()
+                # Everything that changed is saved in a single UPDATE.
+                fields = self._token_fields + self._cooldown_fields
+                fields += self._verified_fields
+                _save_fields(self, fields)
             else:
                 self.throttle_increment()
         else:
@@ -151,6 +177,29 @@ class EmailDevice(TimestampMixin, CooldownMixin, ThrottlingMixin, SideChannelDev
 
         return verified
 
+    async def averify_token(self, token):
+        verify_allowed, _ = await self.averify_is_allowed()
+        if verify_allowed:
+            verified = self._consume_token(token)
+
+            if verified:
+                self.cooldown_reset(commit=False)
+                self.throttle_reset(commit=False)
+                self.set_last_used_timestamp(commit=False)
+                # Asynchronous code can't hold a row lock, so we only save if
+                # no one else has consumed the token in the meantime.
+                fields = self._token_fields + self._cooldown_fields
+                fields += self._verified_fields
+                if not await self._aupdate_if(fields, token=token):
+                    verified = False
+                    await self.arefresh_from_db()
+            else:
+                await self.athrottle_increment()
+        else:
+            verified = False
+
+        return verified
+
     def get_cooldown_duration(self):
         """
         Returns :setting:`OTP_EMAIL_COOLDOWN_DURATION`.
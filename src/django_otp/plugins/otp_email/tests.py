@@ -1,9 +1,10 @@
 from datetime import timedelta
+from unittest import mock
 
 from freezegun import freeze_time
 
 from django.core import mail
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.test.utils import override_settings
 
 from django_otp.forms import OTPAuthenticationForm
@@ -12,6 +13,7 @@ from django_otp.test_utils import (
     TestCase,
     ThrottlingTestMixin,
     TimestampTestMixin,
+    TransactionTestCase,
 )
 
 from .models import EmailDevice
@@ -45,7 +47,8 @@ class AuthFormTest(EmailDeviceMixin, TestCase):
         }
         form = OTPAuthenticationForm(None, data)
 
-        self.assertFalse(form.is_valid())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(form.is_valid())
         alice = form.get_user()
         self.assertEqual(alice.get_username(), 'alice')
         self.assertIsNone(alice.otp_device)
@@ -61,6 +64,52 @@ class AuthFormTest(EmailDeviceMixin, TestCase):
         self.assertIsInstance(form.get_user().otp_device, EmailDevice)
 
 
+@override_settings(OTP_EMAIL_SENDER='test@example.com')
+class DeliveryTestCase(EmailDeviceMixin, TransactionTestCase):
+    def challenge(self):
+        data = {
+            'username': 'alice',
+            'password': 'password',
+            'otp_device': self.device.persistent_id,
+            'otp_token': '',
+            'otp_challenge': '1',
+        }
+        form = OTPAuthenticationForm(None, data)
+        self.assertFalse(form.is_valid())
+
+        return form
+
+    def test_deliver_on_commit(self):
+        with transaction.atomic():
+            self.device.generate_challenge()
+            self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_deliver_without_transaction(self):
+        self.device.generate_challenge()
+
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_form_challenge(self):
+        form = self.challenge()
+
+        self.assertIn('sent by email', str(form.errors))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_form_delivery_failure(self):
+        def send_mail(body, **kwargs):
+            # The token is already saved.
+            self.assertIsNotNone(EmailDevice.objects.get().token)
+            raise ConnectionError('mail server unavailable')
+
+        with mock.patch.object(EmailDevice, 'send_mail', side_effect=send_mail):
+            form = self.challenge()
+
+        self.assertIn('mail server unavailable', str(form.errors))
+        self.assertEqual(len(mail.outbox), 0)
+
+
 @override_settings(
     DEFAULT_FROM_EMAIL="root@localhost",
     OTP_EMAIL_THROTTLE_FACTOR=0,
@@ -80,6 +129,39 @@ class EmailTest(EmailDeviceMixin, TestCase):
         self.assertTrue(self.device.verify_token(token))
         self.assertFalse(self.device.verify_token(token))
 
+    def test_verify_token_single_update(self):
+        self.device.generate_token()
+        token = self.device.token
+
+        with self.assertNumQueries(1):
+            self.assertTrue(self.device.verify_token(token))
+
+        self.device.refresh_from_db()
+        self.assertIsNone(self.device.token)
+        self.assertIsNone(self.device.last_generated_timestamp)
+        self.assertIsNotNone(self.device.last_used_at)
+
+    async def test_averify_token(self):
+        self.device.generate_token(commit=False)
+        await self.device.asave()
+        token = self.device.token
+
+        self.assertTrue(await self.device.averify_token(token))
+        self.assertFalse(await self.device.averify_token(token))
+
+        await self.device.arefresh_from_db()
+        self.assertIsNone(self.device.token)
+
+    async def test_averify_token_replay(self):
+        self.device.generate_token(commit=False)
+        await self.device.asave()
+        other = await EmailDevice.objects.aget(pk=self.device.pk)
+        token = other.token
+
+        self.assertTrue(await self.device.averify_token(token))
+        self.assertFalse(await other.averify_token(token))
+        self.assertIsNone(other.token)
+
     def test_token_expiry(self):
         self.device.generate_token()
         token = self.device.token
@@ -87,8 +169,19 @@ class EmailTest(EmailDeviceMixin, TestCase):
             frozen_time.tick(delta=timedelta(seconds=301))
             self.assertFalse(self.device.verify_token(token))
 
+    def test_token_is_plausible(self):
+        self.assertFalse(self.device.token_is_plausible('123456'))
+
+        self.device.generate_token()
+        self.assertTrue(self.device.token_is_plausible('123456'))
+
+        with freeze_time() as frozen_time:
+            frozen_time.tick(delta=timedelta(seconds=301))
+            self.assertFalse(self.device.token_is_plausible('123456'))
+
     def test_defaults(self):
-        self.device.generate_challenge()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.generate_challenge()
 
         self.assertEqual(len(mail.outbox), 1)
 
@@ -107,7 +200,8 @@ class EmailTest(EmailDeviceMixin, TestCase):
         OTP_EMAIL_BODY_TEMPLATE="Test template: {{token}}",
     )
     def test_settings_with_token_in_subject(self):
-        self.device.generate_challenge()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.generate_challenge()
 
         self.assertEqual(len(mail.outbox), 1)
 
@@ -128,7 +222,8 @@ class EmailTest(EmailDeviceMixin, TestCase):
         OTP_EMAIL_BODY_TEMPLATE="Test template 2: {{token}}",
     )
     def test_settings(self):
-        self.device.generate_challenge()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.generate_challenge()
 
         self.assertEqual(len(mail.outbox), 1)
 
@@ -147,7 +242,8 @@ class EmailTest(EmailDeviceMixin, TestCase):
         OTP_EMAIL_BODY_HTML_TEMPLATE="<div>{{token}}</div>",
     )
     def test_settings_html_template(self):
-        self.device.generate_challenge()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.generate_challenge()
 
         self.assertEqual(len(mail.outbox), 1)
 
@@ -173,7 +269,8 @@ class EmailTest(EmailDeviceMixin, TestCase):
         OTP_EMAIL_BODY_TEMPLATE_PATH="otp/email/custom.txt",
     )
     def test_settings_template_path(self):
-        self.device.generate_challenge()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.generate_challenge()
 
         self.assertEqual(len(mail.outbox), 1)
 
@@ -194,7 +291,8 @@ class EmailTest(EmailDeviceMixin, TestCase):
         OTP_EMAIL_BODY_HTML_TEMPLATE_PATH="otp/email/custom_html.html",
     )
     def test_settings_html_template_path(self):
-        self.device.generate_challenge()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.generate_challenge()
 
         self.assertEqual(len(mail.outbox), 1)
 
@@ -221,7 +319,8 @@ class EmailTest(EmailDeviceMixin, TestCase):
     )
     def test_settings_extra_template_options(self):
         extra_context = {"foo": "extra 1", "bar": "extra 2"}
-        self.device.generate_challenge(extra_context)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.generate_challenge(extra_context)
 
         self.assertEqual(len(mail.outbox), 1)
 
@@ -243,7 +342,8 @@ class EmailTest(EmailDeviceMixin, TestCase):
         self.device.email = 'alice2@example.com'
         self.device.save()
 
-        self.device.generate_challenge()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.generate_challenge()
 
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].to, ['alice2@example.com'])
@@ -5,8 +5,14 @@ from urllib.parse import quote, urlencode
 from django.conf import settings
 from django.db import models
 
-from django_otp.models import Device, ThrottlingMixin, TimestampMixin
-from django_otp.oath import hotp
+from django_otp.models import (
+    Device,
+    OptimisticLockingMixin,
+    ThrottlingMixin,
+    TimestampMixin,
+    _decimal_token_is_plausible,
+)
+from django_otp.oath import hotp_range
 from django_otp.util import hex_validator, random_hex
 
 
@@ -18,7 +24,7 @@ def key_validator(value):
     return hex_validator()(value)
 
 
-class HOTPDevice(TimestampMixin, ThrottlingMixin, Device):
+class HOTPDevice(TimestampMixin, ThrottlingMixin, OptimisticLockingMixin, Device):
     """
     A generic HOTP :class:`~django_otp.models.Device`. The model fields mostly
     correspond to the arguments to :func:`django_otp.oath.hotp`. They all have
@@ -43,6 +49,12 @@ class HOTPDevice(TimestampMixin, ThrottlingMixin, Device):
 
         *BigIntegerField*: The next counter value to expect. (Initial: 0)
 
+    .. attribute:: algorithm
+
+        *CharField*: The HMAC digest used to generate tokens (``'sha1'``,
+        ``'sha256'`` or ``'sha512'``). Not all token generators support the
+        SHA-2 digests. (Default: ``'sha1'``)
+
     """
 
     key = models.CharField(
@@ -62,6 +74,12 @@ class HOTPDevice(TimestampMixin, ThrottlingMixin, Device):
     counter = models.BigIntegerField(
         default=0, help_text="The next counter value to expect."
     )
+    algorithm = models.CharField(
+        max_length=16,
+        choices=[('sha1', 'SHA1'), ('sha256', 'SHA256'), ('sha512', 'SHA512')],
+        default='sha1',
+        help_text="The HMAC digest used to generate tokens.",
+    )
 
     class Meta(Device.Meta):
         verbose_name = "HOTP device"
@@ -73,32 +91,53 @@ class HOTPDevice(TimestampMixin, ThrottlingMixin, Device):
         """
         return unhexlify(self.key.encode())
 
-    def verify_token(self, token):
-        verify_allowed, _ = self.verify_is_allowed()
-        if not verify_allowed:
-            return False
+    _secret_fields = ['key']
+
+    # The fields that a successful verification changes.
+    _verified_fields = [
+        'counter',
+        'throttling_failure_count',
+        'throttling_failure_timestamp',
+        'last_used_at',
+    ]
+
+    optimistic_locking_setting = 'OTP_HOTP_OPTIMISTIC_LOCKING'
+
+    def get_verify_conditions(self):
+        return {'counter__lt': self.counter}
 
+    def token_is_plausible(self, token):
+        """
+        Only decimal tokens of at most :attr:`digits` digits are plausible.
+        """
+        return _decimal_token_is_plausible(token, self.digits)
+
+    def _verify_token(self, token):
+        """
+        Checks the token and, if it's valid, updates our state accordingly,
+        without saving.
+        """
         try:
             token = int(token)
         except Exception:
             verified = False
         else:
-            key = self.bin_key
-
-            for counter in range(self.counter, self.counter + self.tolerance + 1):
-                if hotp(key, counter, self.digits) == token:
-                    verified = True
-                    self.counter = counter + 1
-                    self.throttle_reset(commit=False)
-                    self.set_last_used_timestamp(commit=False)
-                    self.save()
-                    break
+            tokens = hotp_range(
+                self.bin_key,
+                self.counter,
+                self.tolerance + 1,
+                self.digits,
+                self.algorithm,
+            )
+
+            if token in tokens:
+                verified = True
+                self.counter += tokens.index(token) + 1
+                self.throttle_reset(commit=False)
+                self.set_last_used_timestamp(commit=False)
             else:
                 verified = False
 
-        if not verified:
-            self.throttle_increment(commit=True)
-
         return verified
 
     def get_throttle_factor(self):
@@ -116,7 +155,7 @@ class HOTPDevice(TimestampMixin, ThrottlingMixin, Device):
         label = self.user.get_username()
         params = {
             'secret': b32encode(self.bin_key),
-            'algorithm': 'SHA1',
+            'algorithm': self.algorithm.upper(),
             'digits': self.digits,
             'counter': self.counter,
         }
@@ -13,6 +13,8 @@ from django.test.utils import override_settings
 from django.urls import reverse
 
 from django_otp.forms import OTPAuthenticationForm
+from django_otp.models import Device
+from django_otp.oath import hotp
 from django_otp.test_utils import TestCase, ThrottlingTestMixin, TimestampTestMixin
 
 from .admin import HOTPDeviceAdmin
@@ -67,6 +69,42 @@ class HOTPTest(HOTPDeviceMixin, TestCase):
         self.assertFalse(ok)
         self.assertEqual(self.device.counter, 0)
 
+    async def test_averify_token_replay(self):
+        # Asynchronous verification can't lock the device, even by default.
+        other = await HOTPDevice.objects.aget(pk=self.device.pk)
+
+        self.assertTrue(await self.device.averify_token(self.tokens[0]))
+        self.assertFalse(await other.averify_token(self.tokens[0]))
+        self.assertEqual(other.counter, 1)
+
+    def test_token_is_plausible(self):
+        self.assertTrue(self.device.token_is_plausible('000123'))
+        self.assertTrue(self.device.token_is_plausible(999999))
+        self.assertFalse(self.device.token_is_plausible('1000000'))
+        self.assertFalse(self.device.token_is_plausible('-1'))
+        self.assertFalse(self.device.token_is_plausible('abcdef'))
+
+    async def test_averify_token(self):
+        ok = await self.device.averify_token(self.tokens[1])
+        await self.device.arefresh_from_db()
+
+        self.assertTrue(ok)
+        self.assertEqual(self.device.counter, 2)
+
+    def test_algorithm(self):
+        self.device.algorithm = 'sha256'
+        token = hotp(self.device.bin_key, 1, algorithm='sha256')
+
+        self.assertFalse(self.device.verify_token(self.tokens[0]))
+        self.assertTrue(self.device.verify_token(token))
+        self.assertEqual(self.device.counter, 2)
+
+    def test_config_url_algorithm(self):
+        self.device.algorithm = 'sha512'
+        params = parse_qs(urlsplit(self.device.config_url).query)
+
+        self.assertEqual(params['algorithm'][0], 'SHA512')
+
     def test_config_url_no_issuer(self):
         with override_settings(OTP_HOTP_ISSUER=None):
             url = self.device.config_url
@@ -381,6 +419,56 @@ class ThrottlingTestCase(HOTPDeviceMixin, ThrottlingTestMixin, TestCase):
         return -1
 
 
+@override_settings(
+    OTP_HOTP_OPTIMISTIC_LOCKING=True,
+    OTP_HOTP_THROTTLE_FACTOR=0,
+)
+class OptimisticLockingTestCase(HOTPDeviceMixin, TestCase):
+    def test_no_lock(self):
+        device_set = Device._filter_persistent_id(
+            self.device.persistent_id, for_verify=True
+        )
+
+        self.assertFalse(HOTPDevice.lock_for_verify())
+        self.assertFalse(device_set.query.select_for_update)
+
+    def test_verify(self):
+        self.assertTrue(self.device.verify_token(self.tokens[1]))
+        self.device.refresh_from_db()
+
+        self.assertEqual(self.device.counter, 2)
+
+    def test_concurrent_verify(self):
+        other = HOTPDevice.objects.get(pk=self.device.pk)
+
+        self.assertTrue(self.device.verify_token(self.tokens[0]))
+        self.assertFalse(other.verify_token(self.tokens[0]))
+        self.assertEqual(other.counter, 1)
+
+    def test_stale_counter(self):
+        other = HOTPDevice.objects.get(pk=self.device.pk)
+
+        self.assertTrue(self.device.verify_token(self.tokens[0]))
+        self.assertTrue(other.verify_token(self.tokens[1]))
+        self.device.refresh_from_db()
+
+        self.assertEqual(self.device.counter, 2)
+
+    async def test_averify_token(self):
+        other = await HOTPDevice.objects.aget(pk=self.device.pk)
+
+        self.assertTrue(await self.device.averify_token(self.tokens[0]))
+        self.assertFalse(await other.averify_token(self.tokens[0]))
+        self.assertEqual(other.counter, 1)
+
+
+@override_settings(
+    OTP_HOTP_OPTIMISTIC_LOCKING=True,
+)
+class OptimisticThrottlingTestCase(ThrottlingTestCase):
+    pass
+
+
 class TimetstampTestCase(HOTPDeviceMixin, TimestampTestMixin, TestCase):
     def valid_token(self):
         return self.tokens[0]
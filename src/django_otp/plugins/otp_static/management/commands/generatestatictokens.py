@@ -0,0 +1,144 @@
+from contextlib import nullcontext
+import csv
+from itertools import islice
+import sys
+from textwrap import fill
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from django_otp.plugins.otp_static.models import StaticDevice, StaticToken
+
+
+class Command(BaseCommand):
+    help = fill(
+        'Generates static OTP tokens for many users at once. Input is one '
+        'username per line. Each user\'s tokens are added to an arbitrary '
+        'static device attached to the user, creating one if necessary. The '
+        'tokens are written to stdout as "username,token" CSV.',
+        width=78,
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='-',
+            help='The file of usernames to read. Reads stdin if omitted or "-".',
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=1,
+            help='The number of tokens to generate for each user. (Default: 1)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='The number of users to load and save at a time. (Default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        count = options['count']
+        chunk_size = options['chunk_size']
+
+        if count < 1:
+            raise CommandError('--count must be at least 1.')
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        writer = csv.writer(self.stdout, lineterminator='\n')
+        started = time.perf_counter()
+        users = tokens = 0
+
+        with self._open(options['path']) as f:
+            usernames = (line.strip() for line in f)
+            usernames = (username for username in usernames if username)
+            while True:
+                chunk = list(islice(usernames, chunk_size))
+                if not chunk:
+                    break
+
+                with transaction.atomic():
+                    rows = self._generate_chunk(chunk, count)
+                writer.writerows(rows)
+
+                users += len(rows) // count
+                tokens += len(rows)
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            'Generated {0} tokens for {1} users in {2:.2f}s.'.format(
+                tokens, users, elapsed
+            )
+        )
+
+    def _open(self, path):
+        if path == '-':
+            return nullcontext(sys.stdin)
+
+        try:
+            return open(path)
+        except OSError as e:
+            raise CommandError(str(e))
+
+    def _generate_chunk(self, usernames, count):
+        User = get_user_model()
+        lookup = '{0}__in'.format(User.USERNAME_FIELD)
+        users = {
+            user.get_username(): user
+            for user in User.objects.filter(**{lookup: set(usernames)})
+        }
+
+        found = []
+        for username in usernames:
+            if username in users:
+                found.append(username)
+            else:
+                self.stderr.write('User "{0}" does not exist.'.format(username))
+
+        devices = self._devices(users.values())
+        tokens = iter(StaticToken.random_tokens(len(found) * count))
+
+        rows = []
+        static_tokens = []
+        for username in found:
+            device = devices[users[username].pk]
+            for token in islice(tokens, count):
+                static_tokens.append(StaticToken(device=device, token=token))
+                rows.append((username, token))
+
+        StaticToken.objects.bulk_create(static_tokens)
+
+        return rows
+
+    def _devices(self, users):
+        """
+        Returns a dict of each user's first static device by user id, creating
+        any that are missing.
+        """
+        devices = {}
+        device_set = (
+            StaticDevice.objects.filter(user__in=users).only('user').order_by('-pk')
+        )
+        for device in device_set.iterator():
+            devices[device.user_id] = device
+
+        missing = [
+            StaticDevice(user=user, name='Backup Code')
+            for user in users
+            if user.pk not in devices
+        ]
+        created = StaticDevice.objects.bulk_create(missing)
+        if any(device.pk is None for device in created):
+            # Some databases can't return primary keys from bulk inserts.
+            created = StaticDevice.objects.filter(
+                user__in=[device.user_id for device in missing]
+            )
+        for device in created:
+            devices[device.user_id] = device
+
+        return devices
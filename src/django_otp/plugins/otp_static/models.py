@@ -2,12 +2,19 @@ from base64 import b32encode
 from os import urandom
 
 from django.conf import settings
-from django.db import models
+from django.db import connections, models, router
 
-from django_otp.models import Device, ThrottlingMixin, TimestampMixin
+from django_otp.models import (
+    Device,
+    OptimisticLockingMixin,
+    ThrottlingMixin,
+    TimestampMixin,
+    _asave_fields,
+    _save_fields,
+)
 
 
-class StaticDevice(TimestampMixin, ThrottlingMixin, Device):
+class StaticDevice(TimestampMixin, ThrottlingMixin, OptimisticLockingMixin, Device):
     """
     A static :class:`~django_otp.models.Device` simply consists of random
     tokens shared by the database and the user.
@@ -25,24 +32,92 @@ class StaticDevice(TimestampMixin, ThrottlingMixin, Device):
 
     """
 
+    optimistic_locking_setting = 'OTP_STATIC_OPTIMISTIC_LOCKING'
+
+    # The fields that a successful verification changes.
+    _verified_fields = [
+        'throttling_failure_count',
+        'throttling_failure_timestamp',
+        'last_used_at',
+    ]
+
     def get_throttle_factor(self):
         return getattr(settings, 'OTP_STATIC_THROTTLE_FACTOR', 1)
 
+    def token_is_plausible(self, token):
+        """
+        Static tokens are at most 16 characters long.
+        """
+        return 0 < len(str(token)) <= StaticToken._meta.get_field('token').max_length
+
     def verify_token(self, token):
         verify_allowed, _ = self.verify_is_allowed()
         if verify_allowed:
-            match = self.token_set.filter(token=token).first()
-            if match is not None:
-                match.delete()
+            verified = self._consumable_tokens(token).delete()[0] > 0
+            if verified:
                 self.throttle_reset(commit=False)
                 self.set_last_used_timestamp(commit=False)
-                self.save()
+                _save_fields(self, self._verified_fields)
             else:
                 self.throttle_increment()
         else:
-            match = None
+            verified = False
+
+        return verified
+
+    async def averify_token(self, token):
+        verify_allowed, _ = await self.averify_is_allowed()
+        if verify_allowed:
+            token_set = await self._aconsumable_tokens(token)
+            verified = (await token_set.adelete())[0] > 0
+            if verified:
+                self.throttle_reset(commit=False)
+                self.set_last_used_timestamp(commit=False)
+                await _asave_fields(self, self._verified_fields)
+            else:
+                await self.athrottle_increment()
+        else:
+            verified = False
+
+        return verified
+
+    def _consumable_tokens(self, token):
+        """
+        Returns a queryset of at most one of our tokens matching ``token``.
+        Deleting it consumes the token in a single statement, and the number
+        of rows deleted tells us whether we got there before a concurrent
+        verification.
+        """
+        token_set = self.token_set.filter(token=token)
+        if self._can_delete_sliced():
+            token_set = self.token_set.filter(pk__in=token_set.values('pk')[:1])
+        else:
+            token_set = self._token_by_pk(
+                token_set.values_list('pk', flat=True).first()
+            )
+
+        return token_set
+
+    async def _aconsumable_tokens(self, token):
+        token_set = self.token_set.filter(token=token)
+        if self._can_delete_sliced():
+            token_set = self.token_set.filter(pk__in=token_set.values('pk')[:1])
+        else:
+            token_set = self._token_by_pk(
+                await token_set.values_list('pk', flat=True).afirst()
+            )
+
+        return token_set
+
+    def _can_delete_sliced(self):
+        db = router.db_for_write(StaticToken, instance=self)
+
+        return connections[db].features.allow_sliced_subqueries_with_in
 
-        return match is not None
+    def _token_by_pk(self, pk):
+        return (
+            self.token_set.filter(pk=pk) if (pk is not None) else self.token_set.none()
+        )
 
 
 class StaticToken(models.Model):
@@ -72,3 +147,17 @@ class StaticToken(models.Model):
 
         """
         return b32encode(urandom(5)).decode('utf-8').lower()
+
+    @staticmethod
+    def random_tokens(count):
+        """
+        Returns a list of ``count`` new :meth:`random_token` values, reading
+        the random bytes for all of them at once.
+
+        :rtype: list of str
+
+        """
+        data = b32encode(urandom(5 * count)).decode('utf-8').lower()
+        bounds = zip(range(0, len(data), 8), range(8, len(data) + 1, 8))
+
+        return [data[start:end] for start, end in bounds]
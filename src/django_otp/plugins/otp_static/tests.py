@@ -1,11 +1,19 @@
+import csv
+from io import StringIO
+from tempfile import NamedTemporaryFile
+from unittest import mock
+
 from django.contrib.admin import AdminSite
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
-from django.db import IntegrityError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
 from django.test import RequestFactory
 from django.test.utils import override_settings
 
 from django_otp.forms import OTPAuthenticationForm
+from django_otp.models import _throttle_cache
 from django_otp.test_utils import TestCase, ThrottlingTestMixin, TimestampTestMixin
 
 from .admin import StaticDeviceAdmin, StaticTokenInline
@@ -32,6 +40,138 @@ class DeviceTest(TestCase):
 
         str(device)
 
+    def test_verify_token_single_delete(self):
+        device = StaticDevice.objects.create(user=self.user, name="Device")
+        device.token_set.create(token='valid')
+
+        # One DELETE for the token and one UPDATE for the device.
+        with self.assertNumQueries(2):
+            self.assertTrue(device.verify_token('valid'))
+        self.assertFalse(device.token_set.exists())
+
+    def test_verify_token_duplicate(self):
+        device = StaticDevice.objects.create(user=self.user, name="Device")
+        device.token_set.create(token='valid')
+        device.token_set.create(token='valid')
+
+        self.assertTrue(device.verify_token('valid'))
+        self.assertEqual(device.token_set.count(), 1)
+
+    @override_settings(OTP_STATIC_THROTTLE_FACTOR=0)
+    def test_verify_token_without_sliced_subqueries(self):
+        device = StaticDevice.objects.create(user=self.user, name="Device")
+        device.token_set.create(token='valid')
+        device.token_set.create(token='valid')
+
+        with mock.patch.object(
+            connection.features, 'allow_sliced_subqueries_with_in', False
+        ):
+            self.assertFalse(device.verify_token('bogus'))
+            self.assertTrue(device.verify_token('valid'))
+
+        self.assertEqual(device.token_set.count(), 1)
+
+    @override_settings(OTP_STATIC_THROTTLE_FACTOR=0)
+    async def test_averify_token_without_sliced_subqueries(self):
+        device = await StaticDevice.objects.acreate(user=self.user, name="Device")
+        await device.token_set.acreate(token='valid')
+
+        with mock.patch.object(
+            connection.features, 'allow_sliced_subqueries_with_in', False
+        ):
+            self.assertFalse(await device.averify_token('bogus'))
+            self.assertTrue(await device.averify_token('valid'))
+
+        self.assertFalse(await device.token_set.aexists())
+
+    def test_random_tokens(self):
+        tokens = StaticToken.random_tokens(100)
+
+        self.assertEqual(len(set(tokens)), 100)
+        self.assertTrue(all(len(token) == 8 for token in tokens))
+        self.assertTrue(all(token == token.lower() for token in tokens))
+        self.assertEqual(StaticToken.random_tokens(0), [])
+
+    def test_token_is_plausible(self):
+        device = StaticDevice(user=self.user, name="Device")
+
+        self.assertTrue(device.token_is_plausible('abcdefgh'))
+        self.assertTrue(device.token_is_plausible('x' * 16))
+        self.assertFalse(device.token_is_plausible('x' * 17))
+        self.assertFalse(device.token_is_plausible(''))
+
+    def test_throttle_increment_atomic(self):
+        device = StaticDevice.objects.create(user=self.user, name="Device")
+        other = StaticDevice.objects.get(pk=device.pk)
+
+        device.throttle_increment()
+        with self.assertNumQueries(1):
+            other.throttle_increment()
+
+        self.assertEqual(
+            StaticDevice.objects.get(pk=device.pk).throttling_failure_count, 2
+        )
+
+    async def test_athrottle_increment(self):
+        device = await StaticDevice.objects.acreate(user=self.user, name="Device")
+        other = await StaticDevice.objects.aget(pk=device.pk)
+
+        await device.athrottle_increment()
+        await other.athrottle_increment()
+
+        other = await StaticDevice.objects.aget(pk=device.pk)
+        self.assertEqual(other.throttling_failure_count, 2)
+
+    @override_settings(OTP_THROTTLE_CACHE=True)
+    def test_throttle_cache(self):
+        _throttle_cache().clear()
+        device = StaticDevice.objects.create(user=self.user, name="Device")
+        other = StaticDevice.objects.get(pk=device.pk)
+
+        with self.assertNumQueries(0):
+            device.throttle_increment()
+            other.throttle_increment()
+
+        self.assertEqual(other.throttling_failure_count, 2)
+        self.assertEqual(
+            StaticDevice.objects.get(pk=device.pk).throttling_failure_count, 0
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            device.throttle_reset()
+        other.verify_is_allowed()
+        self.assertEqual(other.throttling_failure_count, 0)
+        self.assertIsNone(other.throttling_failure_timestamp)
+
+    @override_settings(OTP_THROTTLE_CACHE=True)
+    async def test_athrottle_increment_cache(self):
+        _throttle_cache().clear()
+        device = await StaticDevice.objects.acreate(user=self.user, name="Device")
+        other = await StaticDevice.objects.aget(pk=device.pk)
+
+        await device.athrottle_increment()
+        await other.athrottle_increment()
+
+        self.assertEqual(other.throttling_failure_count, 2)
+
+    def test_throttle_unsaved(self):
+        device = StaticDevice(user=self.user, name="Device")
+        device.throttle_increment()
+
+        self.assertEqual(
+            StaticDevice.objects.get(pk=device.pk).throttling_failure_count, 1
+        )
+
+    @override_settings(OTP_STATIC_THROTTLE_FACTOR=0)
+    async def test_averify_token(self):
+        device = await StaticDevice.objects.acreate(user=self.user, name="Device")
+        await device.token_set.acreate(token='valid')
+
+        self.assertFalse(await device.averify_token('bogus'))
+        self.assertTrue(await device.averify_token('valid'))
+        self.assertFalse(await device.averify_token('valid'))
+        self.assertFalse(await device.token_set.aexists())
+
 
 class LibTest(TestCase):
     """
@@ -194,6 +334,51 @@ class ThrottlingTestCase(ThrottlingTestMixin, TestCase):
         return 'bogus'
 
 
+@override_settings(OTP_THROTTLE_CACHE=True)
+class CacheThrottlingTestCase(ThrottlingTestCase):
+    def setUp(self):
+        super().setUp()
+        _throttle_cache().clear()
+
+    def failure_count(self):
+        device = StaticDevice.objects.get(pk=self.device.pk)
+        device.verify_is_allowed()
+
+        return device.throttling_failure_count
+
+    def test_reset_on_save(self):
+        self.device.throttle_increment()
+        self.device.throttle_reset(commit=False)
+        self.assertEqual(self.failure_count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.device.save()
+            self.assertEqual(self.failure_count(), 1)
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.failure_count(), 0)
+
+    def test_reset_rolled_back(self):
+        self.device.throttle_increment()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.device.throttle_reset()
+                raise RuntimeError()
+
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.failure_count(), 1)
+
+    def test_reset_lost_update(self):
+        self.device.throttle_increment()
+        self.device.throttle_reset(commit=False)
+        self.assertFalse(self.device._update_if(['name'], name='other'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.save()
+
+        self.assertEqual(self.failure_count(), 1)
+
+
 class TimestampTestCase(TimestampTestMixin, TestCase):
     def setUp(self):
         try:
@@ -265,3 +450,66 @@ class StaticDeviceAdminTest(TestCase):
         ]
 
         self.admin.user_permissions.add(*perms)
+
+
+class GenerateStaticTokensTestCase(TestCase):
+    def setUp(self):
+        try:
+            self.alice = self.create_user('alice', 'password')
+            self.bob = self.create_user('bob', 'password')
+        except IntegrityError:
+            self.skipTest("Unable to create a test user.")
+
+    def generate(self, usernames, *args):
+        with NamedTemporaryFile('w') as f:
+            f.write(''.join('{0}\n'.format(username) for username in usernames))
+            f.flush()
+
+            out, err = StringIO(), StringIO()
+            call_command('generatestatictokens', f.name, *args, stdout=out, stderr=err)
+
+        rows = list(csv.reader(StringIO(out.getvalue())))
+
+        return rows, err.getvalue()
+
+    def test_new_devices(self):
+        rows, _ = self.generate(['alice', 'bob'], '--count', '3')
+
+        self.assertEqual(
+            [username for username, _ in rows], ['alice'] * 3 + ['bob'] * 3
+        )
+        for user in [self.alice, self.bob]:
+            device = user.staticdevice_set.get()
+            self.assertEqual(
+                {token for username, token in rows if username == user.username},
+                set(device.token_set.values_list('token', flat=True)),
+            )
+
+    def test_existing_device(self):
+        device = self.alice.staticdevice_set.create()
+        device.token_set.create(token='existing')
+
+        rows, _ = self.generate(['alice'])
+
+        self.assertEqual(self.alice.staticdevice_set.count(), 1)
+        self.assertEqual(device.token_set.count(), 2)
+        self.assertTrue(device.token_set.filter(token=rows[0][1]).exists())
+
+    def test_chunks(self):
+        # Per chunk: users, devices, new devices (if any) and tokens, inside a
+        # transaction.
+        with self.assertNumQueries(11):
+            rows, _ = self.generate(['alice', 'bob', 'alice'], '--chunk-size', '2')
+
+        self.assertEqual([username for username, _ in rows], ['alice', 'bob', 'alice'])
+        self.assertEqual(self.alice.staticdevice_set.get().token_set.count(), 2)
+
+    def test_no_user(self):
+        rows, err = self.generate(['bogus', 'alice', ''])
+
+        self.assertEqual([username for username, _ in rows], ['alice'])
+        self.assertIn('"bogus" does not exist', err)
+
+    def test_bad_count(self):
+        with self.assertRaises(CommandError):
+            self.generate(['alice'], '--count', '0')
@@ -29,7 +29,7 @@ class TOTPDeviceAdmin(admin.ModelAdmin):
 
     raw_id_fields = ['user']
     readonly_fields = ['created_at', 'last_used_at', 'qrcode_link']
-    radio_fields = {'digits': admin.HORIZONTAL}
+    radio_fields = {'digits': admin.HORIZONTAL, 'algorithm': admin.HORIZONTAL}
 
     def get_list_display(self, request):
         list_display = super().get_list_display(request)
@@ -41,9 +41,16 @@ class TOTPDeviceAdmin(admin.ModelAdmin):
         # Show the key value only for adding new objects or when sensitive data
         # is not hidden.
         if settings.OTP_ADMIN_HIDE_SENSITIVE_DATA and obj:
-            configuration_fields = ['step', 't0', 'digits', 'tolerance']
+            configuration_fields = ['step', 't0', 'digits', 'algorithm', 'tolerance']
         else:
-            configuration_fields = ['key', 'step', 't0', 'digits', 'tolerance']
+            configuration_fields = [
+                'key',
+                'step',
+                't0',
+                'digits',
+                'algorithm',
+                'tolerance',
+            ]
         fieldsets = [
             (
                 'Identity',
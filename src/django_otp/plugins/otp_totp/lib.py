@@ -0,0 +1,31 @@
+from django_otp.oath import TOTP
+
+
+def find_drift(key, step, t0, digits, algorithm, drift, token, at, window):
+    """
+    Searches for the drift value at which a TOTP token was generated.
+
+    This is the implementation for the management command ``findtotpdrift``.
+    It only depends on its arguments, so it's suitable for running in a
+    separate process.
+
+    :param bytes key: The shared secret.
+    :param int drift: The drift to center the search on.
+    :param int token: The captured token.
+    :param at: The Unix time at which the token was captured.
+    :param int window: The number of steps to search on either side of
+        ``drift``.
+
+    :returns: The drift at which ``token`` matches, or ``None``. If the token
+        matches more than once in the window, the result is the one closest to
+        ``drift``.
+    :rtype: int or ``None``
+
+    """
+    totp = TOTP(key, step, t0, digits, drift, algorithm)
+    totp.time = at
+
+    tokens = totp.tokens_in_window(window)
+    offsets = [i - window for i, candidate in enumerate(tokens) if candidate == token]
+
+    return (drift + min(offsets, key=abs)) if offsets else None
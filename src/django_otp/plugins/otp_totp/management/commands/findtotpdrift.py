@@ -0,0 +1,167 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import csv
+from itertools import islice
+import os
+import sys
+from textwrap import fill
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_otp.plugins.otp_totp.lib import find_drift
+from django_otp.plugins.otp_totp.models import TOTPDevice
+
+
+class Command(BaseCommand):
+    help = fill(
+        'Finds the drift of TOTP devices from captured tokens and saves it. '
+        'Input is CSV with one "device_id,token[,unix_time]" row per device; '
+        'the time defaults to now. Corrected devices are written to stdout as '
+        '"device_id,old_drift,new_drift".',
+        width=78,
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='-',
+            help='The CSV file to read. Reads stdin if omitted or "-".',
+        )
+        parser.add_argument(
+            '-w',
+            '--window',
+            type=int,
+            default=500,
+            help='The number of time steps to search on either side of the current drift. (Default: 500)',
+        )
+        parser.add_argument(
+            '-j',
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='The number of worker processes. 0 searches in this process. (Default: CPU count)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='The number of devices to load and save at a time. (Default: 1000)',
+        )
+        parser.add_argument(
+            '-n',
+            '--dry-run',
+            action='store_true',
+            help='Report corrections without saving them.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        chunk_size = options['chunk_size']
+        workers = options['workers']
+
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+
+        executor = ProcessPoolExecutor(workers) if (workers > 0) else None
+        started = time.perf_counter()
+        searched = corrected = 0
+
+        try:
+            with self._open(path) as f:
+                rows = (row for row in csv.reader(f) if row and row[0].strip())
+                while True:
+                    chunk = list(islice(rows, chunk_size))
+                    if not chunk:
+                        break
+
+                    tasks = self._tasks(chunk, options['window'])
+                    devices = self._search_chunk(tasks, executor, workers)
+                    if devices and not options['dry_run']:
+                        TOTPDevice.objects.bulk_update(devices, ['drift'])
+
+                    searched += len(tasks)
+                    corrected += len(devices)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            'Searched {0} devices in {1:.2f}s ({2:.0f} devices/s); {3} {4}.'.format(
+                searched,
+                elapsed,
+                (searched / elapsed) if elapsed else 0,
+                corrected,
+                'to correct' if options['dry_run'] else 'corrected',
+            )
+        )
+
+    def _open(self, path):
+        if path == '-':
+            return nullcontext(sys.stdin)
+
+        try:
+            return open(path, newline='')
+        except OSError as e:
+            raise CommandError(str(e))
+
+    def _tasks(self, rows, window):
+        captured = {}
+        for row in rows:
+            try:
+                device_id = int(row[0])
+                token = int(row[1])
+                at = float(row[2]) if (len(row) > 2) else time.time()
+            except (IndexError, ValueError):
+                raise CommandError('Invalid row: {0}'.format(','.join(row)))
+
+            captured[device_id] = (token, at)
+
+        tasks = []
+        for device in TOTPDevice.objects.filter(pk__in=captured).iterator():
+            token, at = captured.pop(device.pk)
+            args = (
+                device.bin_key,
+                device.step,
+                device.t0,
+                device.digits,
+                device.algorithm,
+                device.drift,
+                token,
+                at,
+                window,
+            )
+            tasks.append((device, args))
+
+        for device_id in captured:
+            self.stderr.write('TOTP device {0} does not exist.'.format(device_id))
+
+        return tasks
+
+    def _search_chunk(self, tasks, executor, workers):
+        if not tasks:
+            return []
+
+        # Workers get find_drift() itself, which doesn't need Django to be set
+        # up, so this works with any multiprocessing start method.
+        devices = [device for device, _ in tasks]
+        columns = list(zip(*(args for _, args in tasks)))
+
+        if executor is not None:
+            chunksize = max(1, len(tasks) // (workers * 4))
+            results = executor.map(find_drift, *columns, chunksize=chunksize)
+        else:
+            results = map(find_drift, *columns)
+
+        corrected = []
+        for device, drift in zip(devices, results):
+            if drift is None:
+                self.stderr.write('No match for TOTP device {0}.'.format(device.pk))
+            elif drift != device.drift:
+                self.stdout.write('{0},{1},{2}'.format(device.pk, device.drift, drift))
+                device.drift = drift
+                corrected.append(device)
+
+        return corrected
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('otp_totp', '0003_add_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='totpdevice',
+            name='algorithm',
+            field=models.CharField(
+                choices=[('sha1', 'SHA1'), ('sha256', 'SHA256'), ('sha512', 'SHA512')],
+                default='sha1',
+                help_text='The HMAC digest used to generate tokens.',
+                max_length=16,
+            ),
+        ),
+    ]
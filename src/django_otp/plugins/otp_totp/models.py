@@ -6,7 +6,13 @@ from urllib.parse import quote, urlencode
 from django.conf import settings
 from django.db import models
 
-from django_otp.models import Device, ThrottlingMixin, TimestampMixin
+from django_otp.models import (
+    Device,
+    OptimisticLockingMixin,
+    ThrottlingMixin,
+    TimestampMixin,
+    _decimal_token_is_plausible,
+)
 from django_otp.oath import TOTP
 from django_otp.util import hex_validator, random_hex
 
@@ -19,7 +25,7 @@ def key_validator(value):
     return hex_validator()(value)
 
 
-class TOTPDevice(TimestampMixin, ThrottlingMixin, Device):
+class TOTPDevice(TimestampMixin, ThrottlingMixin, OptimisticLockingMixin, Device):
     """
     A generic TOTP :class:`~django_otp.models.Device`. The model fields mostly
     correspond to the arguments to :func:`django_otp.oath.totp`. They all have
@@ -65,6 +71,12 @@ class TOTPDevice(TimestampMixin, ThrottlingMixin, Device):
         verification. Only tokens at a higher time step will be verified
         subsequently. (Default: -1)
 
+    .. attribute:: algorithm
+
+        *CharField*: The HMAC digest used to generate tokens (``'sha1'``,
+        ``'sha256'`` or ``'sha512'``). Not all token generators support the
+        SHA-2 digests. (Default: ``'sha1'``)
+
     """
 
     key = models.CharField(
@@ -95,6 +107,12 @@ class TOTPDevice(TimestampMixin, ThrottlingMixin, Device):
         default=-1,
         help_text="The t value of the latest verified token. The next token must be at a higher time step.",
     )
+    algorithm = models.CharField(
+        max_length=16,
+        choices=[('sha1', 'SHA1'), ('sha256', 'SHA256'), ('sha512', 'SHA512')],
+        default='sha1',
+        help_text="The HMAC digest used to generate tokens.",
+    )
 
     class Meta(Device.Meta):
         verbose_name = "TOTP device"
@@ -106,12 +124,34 @@ class TOTPDevice(TimestampMixin, ThrottlingMixin, Device):
         """
         return unhexlify(self.key.encode())
 
-    def verify_token(self, token):
-        OTP_TOTP_SYNC = getattr(settings, 'OTP_TOTP_SYNC', True)
+    _secret_fields = ['key']
+
+    # The fields that a successful verification changes.
+    _verified_fields = [
+        'last_t',
+        'drift',
+        'throttling_failure_count',
+        'throttling_failure_timestamp',
+        'last_used_at',
+    ]
+
+    optimistic_locking_setting = 'OTP_TOTP_OPTIMISTIC_LOCKING'
+
+    def get_verify_conditions(self):
+        return {'last_t__lt': self.last_t}
 
-        verify_allowed, _ = self.verify_is_allowed()
-        if not verify_allowed:
-            return False
+    def token_is_plausible(self, token):
+        """
+        Only decimal tokens of at most :attr:`digits` digits are plausible.
+        """
+        return _decimal_token_is_plausible(token, self.digits)
+
+    def _verify_token(self, token):
+        """
+        Checks the token and, if it's valid, updates our state accordingly,
+        without saving.
+        """
+        OTP_TOTP_SYNC = getattr(settings, 'OTP_TOTP_SYNC', True)
 
         try:
             token = int(token)
@@ -120,7 +160,9 @@ class TOTPDevice(TimestampMixin, ThrottlingMixin, Device):
         else:
             key = self.bin_key
 
-            totp = TOTP(key, self.step, self.t0, self.digits, self.drift)
+            totp = TOTP(
+                key, self.step, self.t0, self.digits, self.drift, self.algorithm
+            )
             totp.time = time.time()
 
             verified = totp.verify(token, self.tolerance, self.last_t + 1)
@@ -130,10 +172,6 @@ class TOTPDevice(TimestampMixin, ThrottlingMixin, Device):
                     self.drift = totp.drift
                 self.throttle_reset(commit=False)
                 self.set_last_used_timestamp(commit=False)
-                self.save()
-
-        if not verified:
-            self.throttle_increment(commit=True)
 
         return verified
 
@@ -153,7 +191,7 @@ class TOTPDevice(TimestampMixin, ThrottlingMixin, Device):
         label = str(self.user.get_username())
         params = {
             'secret': b32encode(self.bin_key),
-            'algorithm': 'SHA1',
+            'algorithm': self.algorithm.upper(),
             'digits': self.digits,
             'period': self.step,
         }
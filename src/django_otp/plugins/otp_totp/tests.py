@@ -1,15 +1,27 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
+from io import StringIO
+from multiprocessing import get_context
+from tempfile import NamedTemporaryFile
 from time import time
+from unittest import mock
 from urllib.parse import parse_qs, urlsplit
 
 from django.contrib.admin.sites import AdminSite
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
-from django.db import IntegrityError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
 from django.test import RequestFactory
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
+from django_otp.models import Device, _throttle_cache, _throttle_cache_keys
+from django_otp.oath import hotp, totp
 from django_otp.test_utils import TestCase, ThrottlingTestMixin, TimestampTestMixin
 
 from .admin import TOTPDeviceAdmin
@@ -101,6 +113,53 @@ class TOTPTest(TOTPDeviceMixin, TestCase):
         self.assertTrue(verified1)
         self.assertFalse(verified2)
 
+    async def test_averify_token(self):
+        verified1 = await self.device.averify_token(self.tokens[3])
+        verified2 = await self.device.averify_token(self.tokens[3])
+        await self.device.arefresh_from_db()
+
+        self.assertTrue(verified1)
+        self.assertFalse(verified2)
+        self.assertEqual(self.device.last_t, 3)
+        self.assertEqual(self.device.throttling_failure_count, 1)
+
+    async def test_averify_token_replay(self):
+        # Asynchronous verification can't lock the device, even by default.
+        other = await TOTPDevice.objects.aget(pk=self.device.pk)
+
+        self.assertTrue(await self.device.averify_token(self.tokens[3]))
+        self.assertFalse(await other.averify_token(self.tokens[3]))
+        self.assertEqual(other.last_t, 3)
+
+    def test_token_is_plausible(self):
+        self.assertTrue(self.device.token_is_plausible(str(self.tokens[0])))
+        self.assertFalse(self.device.token_is_plausible('1000000'))
+        self.assertFalse(self.device.token_is_plausible('bogus'))
+
+    def test_update_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.device.verify_token(self.tokens[3])
+
+        (update,) = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertIn('last_t', update)
+        self.assertNotIn('"key"', update)
+
+    def test_algorithm(self):
+        self.device.algorithm = 'sha256'
+        token = totp(
+            self.device.bin_key, self.device.step, self.device.t0, algorithm='sha256'
+        )
+
+        self.assertNotEqual(token, self.tokens[3])
+        self.assertFalse(self.device.verify_token(self.tokens[3]))
+        self.assertTrue(self.device.verify_token(token))
+
+    def test_config_url_algorithm(self):
+        self.device.algorithm = 'sha512'
+        params = parse_qs(urlsplit(self.device.config_url).query)
+
+        self.assertEqual(params['algorithm'][0], 'SHA512')
+
     def test_config_url(self):
         with override_settings(OTP_TOTP_ISSUER=None):
             url = self.device.config_url
@@ -343,3 +402,172 @@ class TimetstampTestCase(TOTPDeviceMixin, TimestampTestMixin, TestCase):
 
     def invalid_token(self):
         return -1
+
+
+@override_settings(
+    OTP_TOTP_OPTIMISTIC_LOCKING=True,
+    OTP_TOTP_SYNC=False,
+    OTP_TOTP_THROTTLE_FACTOR=0,
+)
+class OptimisticLockingTestCase(TOTPDeviceMixin, TestCase):
+    def test_no_lock(self):
+        device_set = Device._filter_persistent_id(
+            self.device.persistent_id, for_verify=True
+        )
+
+        self.assertFalse(TOTPDevice.lock_for_verify())
+        self.assertFalse(device_set.query.select_for_update)
+
+    def test_verify(self):
+        self.assertTrue(self.device.verify_token(self.tokens[3]))
+        self.device.refresh_from_db()
+
+        self.assertEqual(self.device.last_t, 3)
+        self.assertIsNotNone(self.device.last_used_at)
+
+    def test_concurrent_verify(self):
+        other = TOTPDevice.objects.get(pk=self.device.pk)
+
+        self.assertTrue(self.device.verify_token(self.tokens[3]))
+        self.assertFalse(other.verify_token(self.tokens[3]))
+        self.assertEqual(other.last_t, 3)
+
+    def test_failure_keeps_last_t(self):
+        other = TOTPDevice.objects.get(pk=self.device.pk)
+
+        self.assertTrue(self.device.verify_token(self.tokens[3]))
+        self.assertFalse(other.verify_token(-1))
+        other.refresh_from_db()
+
+        self.assertEqual(other.last_t, 3)
+        self.assertEqual(other.throttling_failure_count, 1)
+
+    async def test_averify_token(self):
+        other = await TOTPDevice.objects.aget(pk=self.device.pk)
+
+        self.assertTrue(await self.device.averify_token(self.tokens[3]))
+        self.assertFalse(await other.averify_token(self.tokens[3]))
+        self.assertEqual(other.last_t, 3)
+
+
+@override_settings(
+    OTP_TOTP_OPTIMISTIC_LOCKING=True,
+)
+class OptimisticThrottlingTestCase(ThrottlingTestCase):
+    pass
+
+
+@override_settings(OTP_THROTTLE_CACHE=True)
+class CacheThrottlingTestCase(ThrottlingTestCase):
+    def setUp(self):
+        super().setUp()
+        _throttle_cache().clear()
+
+    def test_failure_not_saved(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(self.device.verify_token(self.invalid_token()))
+
+        other = TOTPDevice.objects.get(pk=self.device.pk)
+        self.assertEqual(other.throttling_failure_count, 0)
+        self.assertFalse(other.verify_is_allowed()[0])
+        self.assertEqual(other.throttling_failure_count, 1)
+
+    async def test_averify_token(self):
+        cache = _throttle_cache()
+        count_key, timestamp_key = _throttle_cache_keys(self.device)
+        await cache.aset(count_key, 1)
+        await cache.aset(timestamp_key, timezone.now() - timedelta(hours=1))
+
+        # Nothing should use the cache (or anything else) synchronously.
+        get_many = mock.patch.object(cache, 'get_many', side_effect=AssertionError)
+        delete_many = mock.patch.object(
+            cache, 'delete_many', side_effect=AssertionError
+        )
+        handle_update = mock.patch(
+            'django_otp.models._handle_device_update', side_effect=AssertionError
+        )
+        with get_many, delete_many, handle_update:
+            self.assertTrue(await self.device.averify_token(self.valid_token()))
+            self.assertIsNone(await cache.aget(count_key))
+
+            self.assertFalse(await self.device.averify_token(self.invalid_token()))
+            self.assertEqual(await cache.aget(count_key), 1)
+
+
+class FindTOTPDriftTestCase(TestCase):
+    key = '2a2bbba1092ffdd25a328ad1a0a5f5d61d7aacc4'
+
+    def setUp(self):
+        try:
+            alice = self.create_user('alice', 'password')
+        except IntegrityError:
+            self.skipTest("Unable to create the test user.")
+        else:
+            self.device = alice.totpdevice_set.create(key=self.key, t0=0, drift=1)
+
+    def captured(self, drift):
+        """A token captured at t=100 from a prover with the given drift."""
+        return hotp(self.device.bin_key, 100 + drift)
+
+    def find_drift(self, rows, *args):
+        with NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write(''.join('{0}\n'.format(row) for row in rows))
+            f.flush()
+
+            out, err = StringIO(), StringIO()
+            call_command(
+                'findtotpdrift', f.name, '-w', '50', *args, stdout=out, stderr=err
+            )
+
+        self.device.refresh_from_db()
+
+        return out.getvalue(), err.getvalue()
+
+    def test_in_process(self):
+        row = '{0},{1},3000'.format(self.device.pk, self.captured(-20))
+        out, _ = self.find_drift([row], '--workers', '0')
+
+        self.assertEqual(out, '{0},1,-20\n'.format(self.device.pk))
+        self.assertEqual(self.device.drift, -20)
+
+    def test_process_pool(self):
+        row = '{0},{1},3000'.format(self.device.pk, self.captured(40))
+        self.find_drift([row], '--workers', '2')
+
+        self.assertEqual(self.device.drift, 40)
+
+    def test_process_pool_spawn(self):
+        # Spawned workers don't inherit a configured Django.
+        executor = partial(ProcessPoolExecutor, mp_context=get_context('spawn'))
+        row = '{0},{1},3000'.format(self.device.pk, self.captured(40))
+        with mock.patch(
+            'django_otp.plugins.otp_totp.management.commands.findtotpdrift.ProcessPoolExecutor',
+            executor,
+        ):
+            self.find_drift([row], '--workers', '1')
+
+        self.assertEqual(self.device.drift, 40)
+
+    def test_dry_run(self):
+        row = '{0},{1},3000'.format(self.device.pk, self.captured(40))
+        out, _ = self.find_drift([row], '--workers', '0', '--dry-run')
+
+        self.assertEqual(out, '{0},1,40\n'.format(self.device.pk))
+        self.assertEqual(self.device.drift, 1)
+
+    def test_outside_window(self):
+        row = '{0},{1},3000'.format(self.device.pk, self.captured(60))
+        out, err = self.find_drift([row], '--workers', '0')
+
+        self.assertEqual(out, '')
+        self.assertIn('No match', err)
+        self.assertEqual(self.device.drift, 1)
+
+    def test_no_device(self):
+        _, err = self.find_drift(['0,123456'], '--workers', '0')
+
+        self.assertIn('does not exist', err)
+
+    def test_bad_row(self):
+        with self.assertRaises(CommandError):
+            self.find_drift(['bogus'], '--workers', '0')
@@ -3,26 +3,54 @@ from io import StringIO
 import pickle
 from threading import Thread
 import unittest
+from unittest import mock
 
+from django.apps import apps
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from django.db import IntegrityError, connection
-from django.test import AsyncRequestFactory, RequestFactory, skipUnlessDBFeature
+from django.db import IntegrityError, connection, transaction
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    SimpleTestCase,
+    skipUnlessDBFeature,
+)
 from django.test.utils import override_settings
 from django.urls import reverse
+from django.utils import timezone
 
 from django_otp import (
     DEVICE_ID_SESSION_KEY,
+    adevices_for_user,
+    amatch_token,
+    auser_has_device,
+    averify_token,
     device_classes,
+    device_summaries_for_user,
+    devices_for_user,
     match_token,
     oath,
     user_has_device,
     util,
     verify_token,
 )
-from django_otp.forms import OTPTokenForm, otp_verification_failed
+from django_otp.forms import (
+    OTPAuthenticationForm,
+    OTPTokenForm,
+    otp_verification_failed,
+)
 from django_otp.middleware import OTPMiddleware
+from django_otp.models import (
+    Device,
+    _device_cache,
+    _device_cache_key,
+    _device_model,
+    _snapshot_cache,
+    _snapshot_key,
+    device_cache_info,
+)
 from django_otp.plugins.otp_static.models import StaticDevice, StaticToken
 
 from .test_utils import TestCase, TransactionTestCase
@@ -38,6 +66,50 @@ def load_tests(loader, tests, pattern):
     return suite
 
 
+class BulkHOTPTestCase(SimpleTestCase):
+    key = b'12345678901234567890'
+
+    def test_matches_hotp(self):
+        keys = [self.key, b'abcdefghij'] * 50
+        counters = list(range(100))
+
+        self.assertEqual(
+            oath.bulk_hotp(keys, counters, digits=8),
+            [oath.hotp(k, c, digits=8) for k, c in zip(keys, counters)],
+        )
+
+    def test_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            oath.bulk_hotp([self.key], [0, 1])
+
+    def test_many_keys(self):
+        keys = [str(i).encode() for i in range(200)] * 2
+        counters = list(range(400))
+
+        with mock.patch.object(oath, 'HOTP', wraps=oath.HOTP) as engine:
+            tokens = oath.bulk_hotp(keys, counters)
+
+        self.assertEqual(tokens, [oath.hotp(k, c) for k, c in zip(keys, counters)])
+        # Only a few keyed engines are kept, so old keys are prepared again.
+        self.assertEqual(engine.call_count, 400)
+
+        with mock.patch.object(oath, 'HOTP', wraps=oath.HOTP) as engine:
+            oath.bulk_hotp([self.key] * 10 + [b'abcdefghij'] * 10, range(20))
+
+        self.assertEqual(engine.call_count, 2)
+
+    def test_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy is not installed.")
+
+        tokens = oath.bulk_hotp(self.key, numpy.arange(10))
+
+        self.assertIsInstance(tokens, numpy.ndarray)
+        self.assertEqual(tokens.tolist(), oath.bulk_hotp(self.key, range(10)))
+
+
 class TestThread(Thread):
     "Django testing quirk: threads have to close their DB connections."
 
@@ -66,6 +138,92 @@ class APITestCase(TestCase):
         with self.subTest(user='bob'):
             self.assertFalse(user_has_device(self.bob))
 
+    def test_user_has_device_single_query(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(user_has_device(self.alice))
+        with self.assertNumQueries(1):
+            self.assertFalse(user_has_device(self.bob))
+
+    def test_user_has_device_confirmed(self):
+        self.bob.totpdevice_set.create(confirmed=False)
+
+        self.assertFalse(user_has_device(self.bob))
+        self.assertFalse(user_has_device(self.bob, confirmed=True))
+        self.assertTrue(user_has_device(self.bob, confirmed=False))
+        self.assertTrue(user_has_device(self.bob, confirmed=None))
+
+    async def test_auser_has_device(self):
+        self.assertFalse(await auser_has_device(AnonymousUser()))
+        self.assertTrue(await auser_has_device(self.alice))
+        self.assertFalse(await auser_has_device(self.bob))
+
+    def test_device_summaries_for_user(self):
+        totp = self.alice.totpdevice_set.create(name='Phone')
+        static = self.alice.staticdevice_set.get()
+
+        with self.assertNumQueries(1):
+            summaries = device_summaries_for_user(self.alice)
+
+        self.assertEqual(
+            {(s.persistent_id, s.name, s.confirmed) for s in summaries},
+            {
+                (static.persistent_id, static.name, True),
+                (totp.persistent_id, 'Phone', True),
+            },
+        )
+        self.assertEqual({s.device for s in summaries}, {static, totp})
+
+    def test_device_summaries_for_user_lazy(self):
+        device = self.alice.staticdevice_set.get()
+        (summary,) = device_summaries_for_user(self.alice)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(summary.device, device)
+        with self.assertNumQueries(0):
+            summary.device
+
+    def test_device_summaries_for_user_confirmed(self):
+        self.bob.totpdevice_set.create(confirmed=False)
+
+        self.assertEqual(device_summaries_for_user(self.bob), [])
+        self.assertEqual(len(device_summaries_for_user(self.bob, confirmed=False)), 1)
+        self.assertEqual(device_summaries_for_user(AnonymousUser()), [])
+
+    def test_device_summaries_for_user_ordering(self):
+        # Compound statements can't contain ORDER BY on some databases.
+        with mock.patch.object(StaticDevice._meta, 'ordering', ['name']):
+            summaries = device_summaries_for_user(self.alice)
+
+        self.assertEqual(len(summaries), 1)
+
+    def test_device_summaries_for_user_pk_kinds(self):
+        totp = self.alice.totpdevice_set.create(name='Phone')
+        static = self.alice.staticdevice_set.get()
+
+        # Pretend that every device model has a different kind of primary key.
+        with mock.patch('django_otp._pk_kind', lambda model: model.__name__):
+            with self.assertNumQueries(len(device_classes())):
+                summaries = device_summaries_for_user(self.alice)
+
+        self.assertEqual({s.device for s in summaries}, {static, totp})
+
+    def test_otp_token_form(self):
+        self.alice.totpdevice_set.create()
+
+        with self.assertNumQueries(len(device_classes())):
+            form = OTPTokenForm(self.alice)
+
+        self.assertEqual(len(form.fields['otp_device'].choices), 2)
+
+    @override_settings(OTP_DEVICE_SUMMARIES=True)
+    def test_otp_token_form_single_query(self):
+        self.alice.totpdevice_set.create()
+
+        with self.assertNumQueries(1):
+            form = OTPTokenForm(self.alice)
+
+        self.assertEqual(len(form.fields['otp_device'].choices), 2)
+
     def test_verify_token(self):
         device = self.alice.staticdevice_set.first()
 
@@ -75,6 +233,38 @@ class APITestCase(TestCase):
         verified = verify_token(self.alice, device.persistent_id, 'alice')
         self.assertIsNotNone(verified)
 
+    @override_settings(OTP_STATIC_THROTTLE_FACTOR=1)
+    def test_verify_token_throttled(self):
+        device = self.alice.staticdevice_set.get()
+        device.throttle_increment()
+
+        # One unlocked read and no transaction.
+        with self.assertNumQueries(1):
+            verified = verify_token(self.alice, device.persistent_id, 'alice')
+        self.assertIsNone(verified)
+
+    def test_verify_token_other_user(self):
+        device = self.alice.staticdevice_set.get()
+
+        with self.assertNumQueries(1):
+            verified = verify_token(self.bob, device.persistent_id, 'alice')
+        self.assertIsNone(verified)
+
+    @override_settings(OTP_STATIC_THROTTLE_FACTOR=1)
+    def test_otp_token_form_throttled(self):
+        device = self.alice.staticdevice_set.get()
+        device.throttle_increment()
+        form = OTPTokenForm(
+            self.alice,
+            None,
+            {'otp_device': device.persistent_id, 'otp_token': 'alice'},
+        )
+
+        # The unlocked read and the device choices.
+        with self.assertNumQueries(1 + len(device_classes())):
+            self.assertFalse(form.is_valid())
+        self.assertIn('1 failed attempt', str(form.errors))
+
     def test_match_token(self):
         verified = match_token(self.alice, 'bogus')
         self.assertIsNone(verified)
@@ -82,11 +272,226 @@ class APITestCase(TestCase):
         verified = match_token(self.alice, 'alice')
         self.assertEqual(verified, self.alice.staticdevice_set.first())
 
+    def test_match_token_implausible(self):
+        totp = self.alice.totpdevice_set.create()
+
+        verified = match_token(self.alice, 'alice')
+        self.assertEqual(verified, self.alice.staticdevice_set.get())
+
+        # The TOTP device wasn't tried, so it wasn't throttled.
+        totp.refresh_from_db()
+        self.assertEqual(totp.throttling_failure_count, 0)
+
+    def test_match_token_most_recently_used(self):
+        first = self.alice.staticdevice_set.get()
+        first.token_set.create(token='shared')
+        second = self.alice.staticdevice_set.create(last_used_at=timezone.now())
+        second.token_set.create(token='shared')
+
+        self.assertEqual(match_token(self.alice, 'shared'), second)
+        self.assertEqual(match_token(self.alice, 'shared'), first)
+
+    def test_match_token_lock_order(self):
+        first = self.alice.staticdevice_set.get()
+        second = self.alice.staticdevice_set.create(last_used_at=timezone.now())
+        second.token_set.create(token='alice')
+
+        data = {'username': 'alice', 'password': 'password', 'otp_token': 'alice'}
+        form = OTPAuthenticationForm(None, data)
+        with mock.patch.object(
+            Device, 'from_persistent_id', wraps=Device.from_persistent_id
+        ) as from_persistent_id:
+            self.assertTrue(form.is_valid())
+
+        locked = [
+            call.args[0]
+            for call in from_persistent_id.call_args_list
+            if call.kwargs.get('for_verify')
+        ]
+
+        # Locked by primary key, but the most recently used device was tried.
+        self.assertEqual(locked, [first.persistent_id, second.persistent_id])
+        self.assertEqual(form.get_user().otp_device, second)
+
+    async def test_averify_token(self):
+        device = await self.alice.staticdevice_set.afirst()
+
+        verified = await averify_token(self.alice, device.persistent_id, 'bogus')
+        self.assertIsNone(verified)
+
+        verified = await averify_token(self.alice, device.persistent_id, 'alice')
+        self.assertEqual(verified, device)
+
+    @override_settings(OTP_STATIC_OPTIMISTIC_LOCKING=True)
+    async def test_averify_token_native(self):
+        device = await self.alice.staticdevice_set.afirst()
+
+        with mock.patch('django_otp._verify_locked') as verify_locked:
+            verified = await averify_token(self.alice, device.persistent_id, 'alice')
+
+        verify_locked.assert_not_called()
+        self.assertEqual(verified, device)
+        self.assertFalse(await device.token_set.aexists())
+
+    @override_settings(OTP_STATIC_OPTIMISTIC_LOCKING=True)
+    async def test_amatch_token_native(self):
+        device = await self.alice.staticdevice_set.afirst()
+
+        with mock.patch('django_otp.match_token') as match_token:
+            self.assertIsNone(await amatch_token(self.alice, 'bogus'))
+            self.assertEqual(await amatch_token(self.alice, 'alice'), device)
+
+        match_token.assert_not_called()
+
+    async def test_amatch_token(self):
+        verified = await amatch_token(self.alice, 'bogus')
+        self.assertIsNone(verified)
+
+        verified = await amatch_token(self.alice, 'alice')
+        self.assertEqual(verified, await self.alice.staticdevice_set.afirst())
+
+    async def test_adevices_for_user(self):
+        device = await self.alice.staticdevice_set.afirst()
+
+        self.assertEqual([d async for d in adevices_for_user(self.alice)], [device])
+        self.assertEqual([d async for d in adevices_for_user(self.bob)], [])
+        self.assertEqual([d async for d in adevices_for_user(AnonymousUser())], [])
+
     def test_device_classes(self):
         classes = list(device_classes())
 
         self.assertFalse(any(model._meta.proxy for model in classes))
 
+    def test_device_model_cached(self):
+        device = self.alice.staticdevice_set.get()
+        apps.clear_cache()
+
+        with mock.patch.object(apps, 'get_model', wraps=apps.get_model) as get_model:
+            Device.from_persistent_id(device.persistent_id)
+            self.assertEqual(Device.from_persistent_id(device.persistent_id), device)
+
+        self.assertEqual(get_model.call_count, 1)
+        self.assertIsNone(_device_model('auth.user'))
+
+    def test_device_model_registry_change(self):
+        self.assertIs(_device_model('otp_static.staticdevice'), StaticDevice)
+        apps.clear_cache()
+
+        with mock.patch.object(apps, 'get_model', wraps=apps.get_model) as get_model:
+            self.assertIs(_device_model('otp_static.staticdevice'), StaticDevice)
+
+        self.assertEqual(get_model.call_count, 1)
+
+    def test_device_classes_cached(self):
+        classes = device_classes()
+
+        self.assertIs(device_classes(), classes)
+        self.assertIn(StaticDevice, classes)
+
+    def test_device_classes_registry_change(self):
+        classes = device_classes()
+        apps.clear_cache()
+
+        self.assertIsNot(device_classes(), classes)
+        self.assertEqual(device_classes(), classes)
+
+
+@override_settings(OTP_DEVICE_CACHE=True)
+class DeviceCacheTestCase(TestCase):
+    def setUp(self):
+        try:
+            self.alice = self.create_user('alice', 'password')
+        except IntegrityError:
+            self.skipTest("Unable to create a test user.")
+        else:
+            self.device = self.alice.staticdevice_set.create()
+
+        _device_cache().clear()
+        device_cache_info(reset=True)
+
+    def test_read_through(self):
+        with self.assertNumQueries(1):
+            Device.from_persistent_id(self.device.persistent_id)
+        with self.assertNumQueries(0):
+            device = Device.from_persistent_id(self.device.persistent_id)
+
+        self.assertEqual(device, self.device)
+        self.assertEqual(device_cache_info(), (1, 1))
+
+    def test_secrets_not_cached(self):
+        totp = self.alice.totpdevice_set.create()
+        Device.from_persistent_id(totp.persistent_id)
+
+        cached = pickle.dumps(
+            _device_cache().get(_device_cache_key(totp.persistent_id))
+        )
+        self.assertNotIn(totp.key.encode(), cached)
+
+        device = Device.from_persistent_id(totp.persistent_id)
+        with self.assertNumQueries(1):
+            self.assertEqual(device.key, totp.key)
+
+    def test_reset_info(self):
+        Device.from_persistent_id(self.device.persistent_id)
+
+        self.assertEqual(device_cache_info(reset=True), (0, 1))
+        self.assertEqual(device_cache_info(), (0, 0))
+
+    def test_for_verify(self):
+        Device.from_persistent_id(self.device.persistent_id)
+
+        with transaction.atomic(), self.assertNumQueries(1):
+            Device.from_persistent_id(self.device.persistent_id, for_verify=True)
+
+        self.assertEqual(device_cache_info(), (0, 1))
+
+    def test_save(self):
+        Device.from_persistent_id(self.device.persistent_id)
+        self.device.name = 'Renamed'
+        self.device.save()
+
+        device = Device.from_persistent_id(self.device.persistent_id)
+
+        self.assertEqual(device.name, 'Renamed')
+        self.assertEqual(device_cache_info(), (0, 2))
+
+    def test_delete(self):
+        Device.from_persistent_id(self.device.persistent_id)
+        persistent_id = self.device.persistent_id
+        self.device.delete()
+
+        self.assertIsNone(Device.from_persistent_id(persistent_id))
+
+    def test_missing(self):
+        self.assertIsNone(Device.from_persistent_id('otp_static.staticdevice/0'))
+        self.assertIsNone(Device.from_persistent_id('otp_static.staticdevice/0'))
+        self.assertEqual(device_cache_info(), (0, 2))
+
+    @override_settings(OTP_DEVICE_CACHE='default')
+    def test_alias(self):
+        cache.clear()
+
+        Device.from_persistent_id(self.device.persistent_id)
+        with self.assertNumQueries(0):
+            Device.from_persistent_id(self.device.persistent_id)
+
+    @override_settings(OTP_DEVICE_CACHE=False)
+    def test_disabled(self):
+        Device.from_persistent_id(self.device.persistent_id)
+        with self.assertNumQueries(1):
+            Device.from_persistent_id(self.device.persistent_id)
+
+        self.assertEqual(device_cache_info(), (0, 0))
+
+    async def test_afrom_persistent_id(self):
+        persistent_id = self.device.persistent_id
+
+        await Device.afrom_persistent_id(persistent_id)
+        device = await Device.afrom_persistent_id(persistent_id)
+
+        self.assertEqual(device, self.device)
+        self.assertEqual(device_cache_info(), (1, 1))
+
 
 class OTPVerificationFailedSignalTestCase(TestCase):
     def setUp(self):
@@ -210,6 +615,143 @@ class OTPMiddlewareTestCase(TestCase):
         # Should not raise an exception.
         pickle.dumps(request.user)
 
+    def test_device_memo(self):
+        request = self.factory.get('/')
+        request.user = self.alice
+        request.session = {}
+
+        self.middleware(request)
+        user = request.user
+        device = self.alice.staticdevice_set.get()
+
+        self.assertEqual(list(devices_for_user(user)), [device])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(devices_for_user(user)), [device])
+            self.assertTrue(user_has_device(user))
+
+        device.name = 'Renamed'
+        device.save()
+
+        with self.assertNumQueries(len(device_classes())):
+            self.assertEqual(list(devices_for_user(user))[0].name, 'Renamed')
+
+    def test_device_memo_delete(self):
+        request = self.factory.get('/')
+        request.user = self.alice
+        request.session = {}
+
+        self.middleware(request)
+        user = request.user
+
+        self.assertTrue(user_has_device(user))
+        with self.assertNumQueries(0):
+            self.assertTrue(user_has_device(user))
+
+        self.alice.staticdevice_set.get().delete()
+
+        self.assertFalse(user_has_device(user))
+
+    def test_device_memo_for_verify(self):
+        request = self.factory.get('/')
+        request.user = self.alice
+        request.session = {}
+
+        self.middleware(request)
+        list(devices_for_user(request.user))
+
+        with self.assertNumQueries(len(device_classes())):
+            list(devices_for_user(request.user, for_verify=True))
+
+
+@override_settings(OTP_MIDDLEWARE_LAZY_DEVICE=True)
+class OTPMiddlewareLazyTestCase(OTPMiddlewareTestCase):
+    def test_lazy_device(self):
+        request = self.factory.get('/')
+        request.user = self.alice
+        device = self.alice.staticdevice_set.get()
+        request.session = {DEVICE_ID_SESSION_KEY: device.persistent_id}
+
+        self.middleware(request)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(request.user.is_verified())
+            self.assertEqual(request.user.otp_device.user_id, self.alice.pk)
+
+        with self.assertNumQueries(0):
+            self.assertIsInstance(request.user.otp_device, StaticDevice)
+            user = pickle.loads(pickle.dumps(request.user))
+            self.assertEqual(user.otp_device.persistent_id, device.persistent_id)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(request.user.otp_device, device)
+
+
+@override_settings(OTP_MIDDLEWARE_CACHE='default')
+class OTPMiddlewareCacheTestCase(OTPMiddlewareTestCase):
+    def setUp(self):
+        super().setUp()
+        _snapshot_cache().clear()
+
+    def _verify(self, user, persistent_id):
+        request = self.factory.get('/')
+        request.user = user
+        request.session = {DEVICE_ID_SESSION_KEY: persistent_id}
+
+        self.middleware(request)
+        request.user.is_verified()
+
+        return request
+
+    def test_snapshot(self):
+        device = self.alice.staticdevice_set.get()
+
+        with self.assertNumQueries(1):
+            self._verify(self.alice, device.persistent_id)
+
+        with self.assertNumQueries(0):
+            request = self._verify(self.alice, device.persistent_id)
+            self.assertTrue(request.user.is_verified())
+            self.assertEqual(
+                request.user.otp_device.persistent_id, device.persistent_id
+            )
+
+        with self.assertNumQueries(1):
+            self.assertEqual(request.user.otp_device.name, device.name)
+
+    def test_snapshot_delete(self):
+        device = self.alice.staticdevice_set.get()
+        self._verify(self.alice, device.persistent_id)
+
+        device.delete()
+        request = self._verify(self.alice, device.persistent_id)
+
+        self.assertFalse(request.user.is_verified())
+        self.assertNotIn(DEVICE_ID_SESSION_KEY, request.session)
+
+    def test_snapshot_wrong_user(self):
+        device = self.bob.staticdevice_set.get()
+
+        for _ in range(2):
+            with self.subTest():
+                request = self._verify(self.alice, device.persistent_id)
+                self.assertFalse(request.user.is_verified())
+
+    def test_snapshot_device_gone(self):
+        # As if the device had been deleted in another process.
+        persistent_id = 'otp_static.staticdevice/0'
+        _snapshot_cache().set(_snapshot_key(persistent_id), self.alice.pk)
+
+        request = self._verify(self.alice, persistent_id)
+
+        self.assertTrue(request.user.is_verified())
+        with self.assertRaises(StaticDevice.DoesNotExist):
+            request.user.otp_device.name
+
+
+@override_settings(OTP_MIDDLEWARE_CACHE=True)
+class OTPMiddlewareLocalCacheTestCase(OTPMiddlewareCacheTestCase):
+    pass
+
 
 class OTPMiddlewareAsyncTestCase(TestCase):
     def setUp(self):
@@ -309,6 +851,30 @@ class OTPMiddlewareAsyncTestCase(TestCase):
         pickle.dumps(user)
 
 
+@override_settings(OTP_MIDDLEWARE_LAZY_DEVICE=True)
+class OTPMiddlewareAsyncLazyTestCase(OTPMiddlewareAsyncTestCase):
+    pass
+
+
+@override_settings(OTP_MIDDLEWARE_CACHE='default')
+class OTPMiddlewareAsyncCacheTestCase(OTPMiddlewareAsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    async def test_snapshot(self):
+        session = {DEVICE_ID_SESSION_KEY: self.alice_device_pid}
+
+        request = await self._run_middleware(self.alice, session)
+        user = await request.auser()
+        self.assertTrue(user.is_verified())
+
+        request = await self._run_middleware(self.alice, session)
+        user = await request.auser()
+        self.assertTrue(user.is_verified())
+        self.assertEqual(user.otp_device.persistent_id, self.alice_device_pid)
+
+
 class LoginViewTestCase(TestCase):
     def setUp(self):
         try:
@@ -436,6 +1002,10 @@ class ConcurrencyTestCase(TransactionTestCase):
 
         self.assertEqual(sum(1 for t in threads if t.verified is not None), 1)
 
+    @override_settings(OTP_STATIC_OPTIMISTIC_LOCKING=True)
+    def test_verify_token_optimistic(self):
+        self.test_verify_token()
+
     def test_match_token(self):
         class VerifyThread(Thread):
             def __init__(self, user, token):
@@ -1,6 +1,5 @@
 from binascii import unhexlify
 from os import urandom
-import random
 import string
 
 from django.core.exceptions import ValidationError
@@ -75,12 +74,14 @@ def random_number_token(length=6):
     :returns: A string of decimal digits.
     :rtype: str
 
+    >>> token = random_number_token(8)
+    >>> len(token), token.isdigit()
+    (8, True)
     """
-    rand = random.SystemRandom()
-
-    if hasattr(rand, 'choices'):
-        digits = rand.choices(string.digits, k=length)
-    else:
-        digits = (rand.choice(string.digits) for i in range(length))
+    # Bytes from 250 up are rejected so that each digit is equally likely.
+    digits = []
+    while len(digits) < length:
+        data = urandom(length - len(digits))
+        digits.extend(string.digits[b % 10] for b in data if b < 250)
 
     return ''.join(digits)
@@ -0,0 +1,33 @@
+"""
+Shared setup for the benchmark scripts.
+
+Importing this puts the source tree and the test project on the path and sets
+up Django with the test project's settings.
+"""
+
+import os.path
+import sys
+from timeit import Timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+
+def report(name, func, count=None):
+    """
+    Prints the best per-call time of func in microseconds. If count is given,
+    the time per token is included as well.
+    """
+    timer = Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=5, number=number)) / number
+
+    line = '{0:<40} {1:>10.2f} us'.format(name, best * 1e6)
+    if count is not None:
+        line += '  ({0:.2f} us/token)'.format(best * 1e6 / count)
+    print(line)
@@ -0,0 +1,92 @@
+"""
+Micro-benchmarks for django_otp.middleware.
+
+Run with ``hatch run bench middleware`` or ``python test/benchmarks/middleware.py``.
+This uses the test project's settings and a throwaway test database.
+"""
+
+from common import report
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from django_otp import DEVICE_ID_SESSION_KEY
+from django_otp.middleware import OTPMiddleware
+from django_otp.models import Device
+
+
+def legacy_filter_persistent_id(persistent_id):
+    """The original implementation: parse and resolve on every call."""
+    model_label, device_id = persistent_id.rsplit("/", 1)
+    app_label, model_name = model_label.split(".")
+
+    device_cls = apps.get_model(app_label, model_name)
+    if issubclass(device_cls, Device):
+        return device_cls.objects.filter(id=int(device_id))
+    return None
+
+
+def legacy_normalize_persistent_id(persistent_id):
+    if persistent_id.count(".") > 1:
+        parts = persistent_id.split(".")
+        return ".".join((parts[-3], parts[-1]))
+    return persistent_id
+
+
+def bench_parsing(device):
+    persistent_id = device.persistent_id
+    legacy_id = '{0}.{1}/{2}'.format(
+        device.__module__, device.__class__.__name__, device.id
+    )
+    normalize = OTPMiddleware._normalize_persistent_id
+
+    print('Persistent id handling')
+    report(
+        '  uncached _filter_persistent_id()',
+        lambda: legacy_filter_persistent_id(persistent_id),
+    )
+    report(
+        '  _filter_persistent_id()', lambda: Device._filter_persistent_id(persistent_id)
+    )
+    report(
+        '  uncached _normalize_persistent_id()',
+        lambda: legacy_normalize_persistent_id(legacy_id),
+    )
+    report('  _normalize_persistent_id()', lambda: normalize(legacy_id))
+
+
+def bench_requests(user, device):
+    factory = RequestFactory()
+    middleware = OTPMiddleware(lambda request: None)
+
+    def request():
+        request = factory.get('/')
+        request.user = user
+        request.session = {DEVICE_ID_SESSION_KEY: device.persistent_id}
+        middleware(request)
+
+        return request.user.is_verified()
+
+    print('Middleware, per verified request')
+    report('  default', request)
+    with override_settings(OTP_MIDDLEWARE_LAZY_DEVICE=True):
+        report('  OTP_MIDDLEWARE_LAZY_DEVICE', request)
+    with override_settings(OTP_MIDDLEWARE_CACHE='default'):
+        cache.clear()
+        report('  OTP_MIDDLEWARE_CACHE', request)
+
+
+if __name__ == '__main__':
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = get_user_model().objects.create_user('alice')
+        device = user.staticdevice_set.create()
+
+        bench_parsing(device)
+        bench_requests(user, device)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
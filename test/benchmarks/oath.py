@@ -0,0 +1,113 @@
+"""
+Micro-benchmarks for django_otp.oath.
+
+Run with ``hatch run bench`` or ``python test/benchmarks/oath.py``.
+"""
+
+from hashlib import sha1
+import hmac
+import os
+from struct import pack
+
+from common import report
+
+from django_otp.oath import HOTP, TOTP, bulk_hotp, hotp, hotp_range
+
+KEY = b'12345678901234567890'
+
+
+def legacy_hotp(key, counter, digits=6):
+    """The original implementation: a fresh HMAC for every counter."""
+    hs = list(iter(hmac.new(key, pack(b'>Q', counter), sha1).digest()))
+    offset = hs[19] & 0x0F
+    bin_code = (
+        (hs[offset] & 0x7F) << 24
+        | hs[offset + 1] << 16
+        | hs[offset + 2] << 8
+        | hs[offset + 3]
+    )
+
+    return bin_code % pow(10, digits)
+
+
+def bench_verify():
+    # A token that never matches, so every counter in the window is computed.
+    token = -1
+
+    for tolerance in [1, 5, 50]:
+        window = 2 * tolerance + 1
+        print('TOTP verify, tolerance={0} ({1} tokens)'.format(tolerance, window))
+
+        def legacy():
+            for t in range(100 - tolerance, 100 + tolerance + 1):
+                if legacy_hotp(KEY, t) == token:
+                    break
+
+        totp = TOTP(KEY)
+        totp.time = 3000
+
+        report('  per-counter hmac.new()', legacy, window)
+        report('  TOTP.verify()', lambda: totp.verify(token, tolerance), window)
+
+    for tolerance in [1, 5, 50]:
+        window = tolerance + 1
+        print('HOTP verify, tolerance={0} ({1} tokens)'.format(tolerance, window))
+
+        def legacy():
+            for counter in range(100, 100 + tolerance + 1):
+                if legacy_hotp(KEY, counter) == token:
+                    break
+
+        def engine():
+            engine = HOTP(KEY)
+            for counter in range(100, 100 + tolerance + 1):
+                if engine.token(counter) == token:
+                    break
+
+        def batched():
+            return token in hotp_range(KEY, 100, tolerance + 1)
+
+        report('  per-counter hmac.new()', legacy, window)
+        report('  HOTP engine', engine, window)
+        report('  hotp_range()', batched, window)
+
+
+def bench_algorithms():
+    keys = {
+        'sha1': b'12345678901234567890',
+        'sha256': b'12345678901234567890123456789012',
+        'sha512': b'1234567890' * 6 + b'1234',
+    }
+
+    print('Throughput by algorithm')
+    for algorithm, key in keys.items():
+        totp = TOTP(key, algorithm=algorithm)
+        totp.time = 3000
+
+        report(
+            '  {0} hotp()'.format(algorithm),
+            lambda: hotp(key, 100, algorithm=algorithm),
+            1,
+        )
+        report(
+            '  {0} TOTP.verify(tolerance=1)'.format(algorithm),
+            lambda: totp.verify(-1, 1),
+            3,
+        )
+
+
+def bench_bulk():
+    keys = [os.urandom(20) for _ in range(100)]
+    pairs = [(key, counter) for key in keys for counter in range(100)]
+    key_list = [key for key, _ in pairs]
+    counter_list = [counter for _, counter in pairs]
+
+    print('Bulk generation ({0} tokens)'.format(len(pairs)))
+    report('  hotp() loop', lambda: [hotp(k, c) for k, c in pairs], len(pairs))
+    report('  bulk_hotp()', lambda: bulk_hotp(key_list, counter_list), len(pairs))
+
+
+if __name__ == '__main__':
+    bench_verify()
+    bench_algorithms()
+    bench_bulk()
@@ -0,0 +1,56 @@
+"""
+Micro-benchmarks for django_otp.util and static token generation.
+
+Run with ``hatch run bench util`` or ``python test/benchmarks/util.py``.
+"""
+
+import random
+import string
+
+from common import report
+
+from django_otp.plugins.otp_static.models import StaticToken
+from django_otp.util import random_number_token
+
+
+def legacy_random_number_token(length=6):
+    """The original implementation: a new SystemRandom for every token."""
+    rand = random.SystemRandom()
+
+    return ''.join(rand.choices(string.digits, k=length))
+
+
+def bench_single():
+    print('One token')
+    report('  SystemRandom() random_number_token()', legacy_random_number_token, 1)
+    report('  random_number_token()', random_number_token, 1)
+    report('  StaticToken.random_token()', StaticToken.random_token, 1)
+
+
+def bench_many(count=10000):
+    print('{0} tokens'.format(count))
+    report(
+        '  SystemRandom() random_number_token()',
+        lambda: [legacy_random_number_token() for _ in range(count)],
+        count,
+    )
+    report(
+        '  random_number_token()',
+        lambda: [random_number_token() for _ in range(count)],
+        count,
+    )
+    report(
+        '  StaticToken.random_token()',
+        lambda: [StaticToken.random_token() for _ in range(count)],
+        count,
+    )
+    report(
+        '  StaticToken.random_tokens()',
+        lambda: StaticToken.random_tokens(count),
+        count,
+    )
+
+
+if __name__ == '__main__':
+    bench_single()
+    bench_many()